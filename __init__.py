@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import os
 import json
 import random
@@ -11,7 +12,7 @@ from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.core.provider.entities import LLMResponse
 import astrbot.core.message.components as Comp
-from PIL import Image # For auto_collect_image to get image info
+from PIL import Image # For auto-collection to get image info
 
 # Local imports
 from .game import GameSystem
@@ -22,11 +23,32 @@ from .config import QGCJConfig, load_config, save_config
 # Gallery plugin core modules
 from .core.gallery import Gallery
 from .core.gallery_manager import GalleryManager
+from .core.eviction import EVICTION_POLICIES
+from .core.image_cache import ImageCache
+from .core.probe import probe_image
+from .core.hash_index import hash_bytes
+from .core.url_cache import url_cache
+from .core.ingest import IngestQueue
+from .core.moderation import SensitiveWordFilter
+from .core.pipeline import MessageContext, MessagePipeline
 from .core.parse import get_image_info, check_image_name, check_gallery_name
-from .utils import compress_image, download_file, get_nickname, get_image
+from .utils import (
+    FetchedImage,
+    close_http_client,
+    compress_image,
+    compress_image_sync,
+    download_file,
+    fetch_image,
+    fetch_image_component,
+    get_file,
+    get_nickname,
+    shutdown_compress_executor,
+)
 
 # Constants for Gallery Plugin
 GALLERIES_INFO_FILE = os.path.join(os.path.dirname(__file__), "data", "plugins_data", "qgcj_gallery_info.json")
+DEDUPE_PROGRESS_MIN_FILES = 500
+UPLOAD_DIR_NAME = "qgcj_uploads"
 
 @register("qgcj", "YourName", "群管理插件与图库功能", "1.0.0")
 class QGCJPlugin(Star):
@@ -64,17 +86,50 @@ class QGCJPlugin(Star):
             "compress": self.config.add_default.default_compress,
             "duplicate": self.config.add_default.default_duplicate,
             "fuzzy": self.config.add_default.default_fuzzy,
+            "similar": self.config.add_default.default_similar,
+            "similar_threshold": self.config.add_default.similar_threshold,
+            "layout": self.config.add_default.default_layout,
+            "eviction": self.config.add_default.default_eviction,
         }
         self.gallery_manager = GalleryManager(
-            galleries_dirs, GALLERIES_INFO_FILE, default_gallery_info
+            galleries_dirs,
+            GALLERIES_INFO_FILE,
+            default_gallery_info,
+            rescan_interval=self.config.gallery_main.rescan_interval * 60,
+            placement=self.config.gallery_main.placement,
         )
-        asyncio.create_task(self.gallery_manager.initialize())
+        self._gallery_init_task = asyncio.create_task(self.gallery_manager.initialize())
+        self.image_cache = ImageCache(self.config.gallery_main.image_cache_mb * 1024 * 1024)
+        collect_config = self.config.auto_collect
+        self.collect_queue = IngestQueue(
+            self._prepare_collected,
+            self._commit_collected,
+            maxsize=collect_config.queue_size,
+            workers=collect_config.workers,
+            batch_size=collect_config.batch_size,
+            rate=collect_config.group_rate_per_minute / 60,
+            burst=collect_config.group_burst,
+        )
+        self.sensitive_filter = SensitiveWordFilter(self.config.moderation.sensitive_words)
+        # Every message goes through one ordered pipeline instead of several ALL handlers
+        self.message_pipeline = MessagePipeline()
+        self.message_pipeline.add("gate", self._gate_stage)
+        self.message_pipeline.add("moderation", self._moderation_stage)
+        self.message_pipeline.add("match", self._match_stage)
+        self.message_pipeline.add("collect", self._collect_stage)
+
+    async def terminate(self):
+        # Commit collected images, then flush pending gallery metadata and close the image catalog
+        await self.collect_queue.close()
+        await self.gallery_manager.close()
+        shutdown_compress_executor()
+        await close_http_client()
 
     async def _creat_gallery(self, event: AstrMessageEvent, name: str) -> Gallery:
         # Helper function from original plugin, made into a method
         gallery_info = self.gallery_manager.default_gallery_info.copy()
-        # Ensure path is within configured galleries_dirs, using the first one
-        gallery_info["path"] = os.path.join(self.gallery_manager.galleries_dirs[0], name)
+        # Place the new gallery in one of the configured galleries_dirs according to the placement policy
+        gallery_info["path"] = self.gallery_manager.new_gallery_path(name)
         gallery_info["name"] = name # Ensure name is updated in info
         gallery_info["creator_id"] = event.get_sender_id()
         gallery_info["creator_name"] = event.get_sender_name() # This seems like a bug in original as it overwrites creator_id, but keeping original behavior
@@ -116,7 +171,50 @@ class QGCJPlugin(Star):
 
     async def _get_image(self, event: AstrMessageEvent, reply: bool = True) -> bytes | None:
         # Helper function to get image bytes from event
-        return await get_image(event, reply)
+        fetched = await self._fetch_image(event, reply)
+        return fetched.data if fetched else None
+
+    async def _fetch_image(self, event: AstrMessageEvent, reply: bool = True) -> FetchedImage | None:
+        # Streamed, size-capped download; the content hash comes back with the bytes
+        return await fetch_image(event, reply, self.config.gallery_main.max_image_mb * 1024 * 1024)
+
+    async def _stored_bytes(self, gallery, fetched: FetchedImage, droppable: bool = False) -> tuple | None:
+        # Bytes to store and their content hash; None when auto-collect compression was shed
+        if not gallery.compress:
+            return fetched.data, fetched.digest
+        max_size = self.config.add_default.compress_size
+        if fetched.stored:
+            # Bytes read back from a stored image were compressed already when they fit the limit
+            info = probe_image(fetched.data)
+            if info and max(info["width"], info["height"]) <= max_size:
+                return fetched.data, fetched.digest
+        image_bytes = await compress_image(fetched.data, max_size, droppable=droppable)
+        if image_bytes is None:
+            return None
+        return image_bytes, hash_bytes(image_bytes)
+
+    def _remember_source(self, fetched: FetchedImage, digest: Optional[str]):
+        # The link maps to what was stored, compressed or not: a repeat skips the download and the compression
+        if not fetched.source or not digest:
+            return
+        for path in self.gallery_manager.catalog.paths_by_hash(digest):
+            if os.path.exists(path):
+                url_cache.put(fetched.source, digest, path)
+                return
+
+    def _shuffle_scope(self, event: AstrMessageEvent) -> Optional[str]:
+        # Per-group rotation when enabled; otherwise every chat shares one rotation per gallery
+        if self.config.gallery_main.shuffle_per_group:
+            return event.get_group_id() or None
+        return None
+
+    def _image_result(self, event: AstrMessageEvent, gallery, image_path: str) -> MessageEventResult:
+        # Serve hot gallery images from the in-memory base64 cache, falling back to the path
+        self.gallery_manager.record_serve(gallery, image_path)
+        image_b64 = self.image_cache.get_base64(image_path)
+        if image_b64:
+            return event.chain_result([Comp.Image.fromBase64(image_b64)])
+        return event.image_result(image_path)
 
 
     # Help command (QGCJ original)
@@ -145,7 +243,7 @@ class QGCJPlugin(Star):
 
 图库功能：
 - 存图 [图库名] [标签]：存储图片到图库 (回复图片消息)
-- 删图 [图库名] [图片名]：删除图库中的图片
+- 删图 [图库名] [图片名]：删除图库中的图片 (分片布局的图库可用至少8位的哈希前缀)
 - 查看 [图库名]：查看图库中的随机图片
 - 图库列表：查看所有图库
 - 图库详情 [图库名]：查看图库详细信息
@@ -307,110 +405,172 @@ class QGCJPlugin(Star):
 
     # Gallery Plugin Integration
 
-    # auto_collect_image (original @filter.event_message_type(EventMessageType.ALL))
+    # Single ALL-message handler: gate -> moderation -> match -> collect, sharing one parse of the message
     @filter.event_message_type(filter.EventMessageType.ALL)
-    async def auto_collect_image(self, event: AstrMessageEvent):
-        if not self.config.enabled or not self.config.auto_collect.enable_collect:
-            return
+    async def on_message(self, event: AstrMessageEvent):
+        async for result in self.message_pipeline.run(MessageContext(event)):
+            yield result
+
+    async def _gate_stage(self, ctx: MessageContext):
+        if not self.config.enabled or not self.gallery_manager.is_ready:
+            ctx.stop()
+
+    async def _moderation_stage(self, ctx: MessageContext):
+        if not self.config.moderation.enabled or not ctx.text:
+            return None
+        word = self.sensitive_filter.find(ctx.text)
+        if word is None:
+            return None
+        # Flagged messages neither trigger gallery replies nor get collected
+        ctx.stop()
+        count = self.sensitive_filter.warn(ctx.sender_id)
+        logger.info(f"检测到敏感词【{word}】，用户 {ctx.sender_id} 累计 {count} 次")
+        if self.config.moderation.warn:
+            return ctx.event.plain_result(f"警告：检测到敏感词 '{word}'，这是第 {count} 次警告")
+        return None
+
+    async def _match_stage(self, ctx: MessageContext):
+        text = ctx.text
+        if not (self.config.user_trigger.user_min_msg_len <= len(text) <= self.config.user_trigger.user_max_msg_len):
+            return None
+
+        matched = await self._match(
+            text,
+            self.config.user_trigger.user_exact_prob,
+            self.config.user_trigger.user_fuzzy_prob,
+            self.config.user_trigger.user_fuzzy_policy,
+            self._shuffle_scope(ctx.event),
+            ctx.group_id,
+        )
+        if matched:
+            gallery, image_path = matched
+            return self._image_result(ctx.event, gallery, str(image_path))
+        return None
+
+    async def _collect_stage(self, ctx: MessageContext):
+        if not self.config.auto_collect.enable_collect:
+            return None
 
         # Group chat whitelist
-        group_id = event.get_group_id()
+        group_id = ctx.group_id
         if self.config.auto_collect.white_list and group_id and group_id not in self.config.auto_collect.white_list:
-            return
+            return None
 
         # Respond to messages containing a single image
-        chain = event.get_messages()
-        if len(chain) == 1 and isinstance(chain[0], Comp.Image):
-            gallery_name = "auto_collected" # Default gallery for auto-collection
-            label = "auto" # Default label
+        image = ctx.single_image
+        if image is None:
+            return None
+        gallery_name = "auto_collected" # Default gallery for auto-collection
 
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            # Create a default gallery if it doesn't exist
+            gallery = await self._creat_gallery(ctx.event, name=gallery_name)
+            if not gallery:
+                logger.error(f"Failed to create auto-collect gallery: {gallery_name}")
+                return None
+            # A full auto-collect gallery keeps collecting by evicting old images
+            gallery.set_eviction(self.config.auto_collect.collect_eviction)
+            self.gallery_manager.mark_dirty(gallery.name)
+
+        # Download, compression and writes happen in the ingest workers; the handler never waits on them
+        self.collect_queue.offer(group_id or ctx.sender_id, (gallery_name, image, ctx.sender_id))
+        return None
+
+    async def _prepare_collected(self, job: tuple) -> tuple | None:
+        gallery_name, comp, sender_id = job
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            return None
+        fetched = await fetch_image_component(comp, self.config.gallery_main.max_image_mb * 1024 * 1024)
+        if not fetched:
+            logger.warning("Failed to get image bytes for auto-collection.")
+            return None
+
+        # If configured to "not collect images that need compression" and current image needs compression
+        if not self.config.auto_collect.collect_compressed_img and gallery.compress:
+            try:
+                # Header-only probe; fall back to PIL for formats it does not recognise
+                info = probe_image(fetched.data)
+                if info:
+                    width, height = info["width"], info["height"]
+                else:
+                    from io import BytesIO
+                    width, height = Image.open(BytesIO(fetched.data)).size
+                if max(width, height) > self.config.add_default.compress_size:
+                    # If it would be compressed and we don't collect compressed, then skip.
+                    logger.info(f"Skipping auto-collection: image needs compression and collect_compressed_img is false for gallery {gallery_name}.")
+                    # If gallery is empty, delete it
+                    if not gallery.images:
+                        await self.gallery_manager.delete_gallery(gallery_name)
+                    return None
+            except Exception as e:
+                logger.warning(f"Error checking image for compression during auto-collect: {e}")
+                # Continue, don't block collection due to this error
+
+        # Auto-collect is the first work shed when the compression pool is backed up
+        stored = await self._stored_bytes(gallery, fetched, droppable=True)
+        if stored is None:
+            return None
+        image_bytes, digest = stored
+        return gallery_name, image_bytes, digest, fetched, sender_id
+
+    async def _commit_collected(self, items: List[tuple]):
+        # One batch per gallery: a single hash-index save, catalog transaction and info write
+        by_gallery: Dict[str, List[tuple]] = {}
+        for item in items:
+            by_gallery.setdefault(item[0], []).append(item)
+        for gallery_name, batch in by_gallery.items():
             gallery = self.gallery_manager.get_gallery(gallery_name)
             if not gallery:
-                # Create a default gallery if it doesn't exist
-                gallery = await self._creat_gallery(event, name=gallery_name)
-                if not gallery:
-                    logger.error(f"Failed to create auto-collect gallery: {gallery_name}")
-                    return
-
-            if image_bytes := await self._get_image(event, reply=False): # reply=False as it's the current message
-                # If configured to "not collect images that need compression" and current image needs compression
-                if not self.config.auto_collect.collect_compressed_img and gallery.compress:
-                    try:
-                        from io import BytesIO
-                        img = Image.open(BytesIO(image_bytes))
-                        width, height = img.size
-                        # Assume need_compress based on original size vs compress_size
-                        if max(width, height) > self.config.add_default.compress_size:
-                            if not self.config.auto_collect.collect_compressed_img:
-                                # If it would be compressed and we don't collect compressed, then skip.
-                                logger.info(f"Skipping auto-collection: image needs compression and collect_compressed_img is false for gallery {gallery_name}.")
-                                # If gallery is empty, delete it
-                                if not os.listdir(gallery.path):
-                                     await self.gallery_manager.delete_gallery(gallery_name)
-                                return # Skip collection
-                    except Exception as e:
-                        logger.warning(f"Error checking image for compression during auto-collect: {e}")
-                        # Continue, don't block collection due to this error
-
-                result = gallery.add_image(image=image_bytes, label=label)
-                logger.info(f"自动收集图片：{result}")
-            else:
-                logger.warning("Failed to get image bytes for auto-collection.")
-
-    # handle_match - Exact/Fuzzy matching for user messages (original @filter.event_message_type(EventMessageType.ALL))
-    @filter.event_message_type(filter.EventMessageType.ALL)
-    async def handle_match(self, event: AstrMessageEvent):
-        if not self.config.enabled:
-            return
-
-        text = event.message_str.strip()
-        if not (self.config.user_trigger.user_min_msg_len <= len(text) <= self.config.user_trigger.user_max_msg_len):
-            return
-
-        image_path = await self._match(
-            text, self.config.user_trigger.user_exact_prob, self.config.user_trigger.user_fuzzy_prob
-        )
-        if image_path:
-            yield event.image_result(str(image_path))
-
+                continue
+            results = await gallery.add_images([(image_bytes, "auto", sender_id, digest) for _, image_bytes, digest, _, sender_id in batch])
+            for _, _, digest, fetched, _ in batch:
+                self._remember_source(fetched, digest)
+            self.gallery_manager.mark_dirty(gallery.name) # Eviction records live in gallery info
+            added = sum(1 for result in results if result.startswith("已添加"))
+            logger.info(f"自动收集图片：图库【{gallery_name}】新增 {added}/{len(batch)} 张")
 
     # _match helper function (from original plugin, made into a method)
-    async def _match(self, text: str, exact_prob: float, fuzzy_prob: float) -> str | None:
+    async def _match(
+        self,
+        text: str,
+        exact_prob: float,
+        fuzzy_prob: float,
+        fuzzy_policy: str = "longest",
+        scope: Optional[str] = None,
+        group_id: Optional[str] = None,
+    ) -> tuple | None:
+        # Returns (gallery, image path) of the matched image
+        # Cheap pre-filter: most messages cannot hit any keyword
+        if not self.gallery_manager.prefilter.may_match(text):
+            return None
+
         image_path = None
-        # Exact match
-        if text in self.gallery_manager.exact_keywords:
-            if random.random() < exact_prob:
-                # Original had `get_gallery_by_attribute(name=text)`, which was likely incorrect.
-                # It should find galleries that contain `text` as an exact keyword.
-                galleries_with_exact_keyword = self.gallery_manager.get_gallery_by_keyword(text)
-                if galleries_with_exact_keyword:
-                    # Filter to only galleries where `text` is an exact keyword
-                    filtered_galleries = [g for g in galleries_with_exact_keyword if text in g.exact_keywords]
-                    if filtered_galleries:
-                        gallery = random.choice(filtered_galleries)
-                        image_path = gallery.get_random_image()
-                        logger.info(f"匹配到图片（精准）：{image_path}")
-        
+        # Candidate galleries (exact lookup + Aho-Corasick fuzzy hits) are memoised per text until keywords change;
+        # the probability rolls and image choice below still happen for every message
+        candidates = self.gallery_manager.resolve_candidates(text, fuzzy_policy, group_id)
+        galleries_with_exact_keyword = self.gallery_manager.get_galleries(candidates.exact)
+        if galleries_with_exact_keyword and random.random() < exact_prob:
+            gallery = random.choice(galleries_with_exact_keyword)
+            image_path = gallery.get_random_image(scope)
+            logger.info(f"匹配到图片（精准）：{image_path}")
+
         if not image_path: # Only try fuzzy if exact match not found
-            # Fuzzy match
-            for keyword in self.gallery_manager.fuzzy_keywords:
-                if keyword in text: # If fuzzy keyword is a substring of the message text
-                    if random.random() < fuzzy_prob:
-                        galleries_with_fuzzy_keyword = self.gallery_manager.get_gallery_by_keyword(keyword)
-                        if galleries_with_fuzzy_keyword:
-                            # Filter to only galleries where `keyword` is a fuzzy keyword
-                            filtered_galleries = [g for g in galleries_with_fuzzy_keyword if keyword in g.fuzzy_keywords]
-                            if filtered_galleries:
-                                gallery = random.choice(filtered_galleries)
-                                image_path = gallery.get_random_image()
-                                logger.info(f"匹配到图片（模糊）：{image_path}")
-                                break # Stop after first fuzzy match
-        return image_path
+            for keyword, gallery_names in candidates.fuzzy:
+                if random.random() < fuzzy_prob:
+                    galleries_with_fuzzy_keyword = self.gallery_manager.get_galleries(gallery_names)
+                    if galleries_with_fuzzy_keyword:
+                        gallery = random.choice(galleries_with_fuzzy_keyword)
+                        image_path = gallery.get_random_image(scope)
+                        logger.info(f"匹配到图片（模糊）：{image_path}")
+                        break # Stop after first fuzzy match
+        return (gallery, image_path) if image_path else None
 
     # on_llm_response hook (original @filter.on_llm_response())
     @filter.on_llm_response()
     async def on_llm_response(self, event: AstrMessageEvent, resp: LLMResponse):
-        if not self.config.enabled:
+        if not self.config.enabled or not self.gallery_manager.is_ready:
             return
             
         chain = resp.result_chain.chain
@@ -421,11 +581,17 @@ class QGCJPlugin(Star):
         if not (self.config.llm_trigger.llm_min_msg_len <= len(text) <= self.config.llm_trigger.llm_max_msg_len):
             return
             
-        image_path = await self._match(
-            text, self.config.llm_trigger.llm_exact_prob, self.config.llm_trigger.llm_fuzzy_prob
+        matched = await self._match(
+            text,
+            self.config.llm_trigger.llm_exact_prob,
+            self.config.llm_trigger.llm_fuzzy_prob,
+            self.config.llm_trigger.llm_fuzzy_policy,
+            self._shuffle_scope(event),
+            event.get_group_id() or None,
         )
-        if image_path:
-            await event.send(event.image_result(image_path))
+        if matched:
+            gallery, image_path = matched
+            await event.send(self._image_result(event, gallery, image_path))
 
     # Gallery Commands (integrating gradually)
 
@@ -435,6 +601,10 @@ class QGCJPlugin(Star):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
         reply = f"【精准匹配词】：\n{str(self.gallery_manager.exact_keywords)}"
         yield event.plain_result(reply)
 
@@ -444,15 +614,81 @@ class QGCJPlugin(Star):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
         reply = f"【模糊匹配词】：\n{str(self.gallery_manager.fuzzy_keywords)}"
         yield event.plain_result(reply)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("匹配统计", alias={"match_stats"})
+    async def match_stats_command(self, event: AstrMessageEvent):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        stats = self.gallery_manager.prefilter.stats()
+        msg = "【匹配预过滤统计】：\n"
+        msg += f"检查消息数：{stats['total']}\n"
+        msg += f"放行(进入完整匹配)：{stats['accepted']}\n"
+        msg += f"拦截：{stats['rejected']}\n"
+        msg += f"拦截率：{stats['reject_rate']:.1%}\n"
+        cache_stats = self.gallery_manager.match_cache.stats()
+        msg += "【匹配结果缓存】：\n"
+        msg += f"缓存条目：{cache_stats['entries']}，命中：{cache_stats['hits']}，未命中：{cache_stats['misses']}\n"
+        msg += f"命中率：{cache_stats['hit_rate']:.1%}\n"
+        msg += "【消息流水线】：\n"
+        msg += "\n".join(
+            f"{s['stage']}：执行 {s['runs']} 次，中止 {s['stops']} 次，平均 {s['avg_ms']:.2f} ms"
+            for s in self.message_pipeline.stats()
+        )
+        yield event.plain_result(msg)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("收集统计", alias={"collect_stats"})
+    async def collect_stats_command(self, event: AstrMessageEvent):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        stats = self.collect_queue.stats()
+        msg = "【自动收集统计】：\n"
+        msg += f"队列深度：{stats['depth']} / {stats['maxsize']}\n"
+        msg += f"已入队：{stats['accepted']}，已写入：{stats['committed']}\n"
+        msg += f"队列满丢弃：{stats['dropped_full']}，限流丢弃：{stats['dropped_rate']}\n"
+        msg += f"跳过：{stats['skipped']}，失败：{stats['failed']}"
+        yield event.plain_result(msg)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("缓存统计", alias={"cache_stats"})
+    async def cache_stats_command(self, event: AstrMessageEvent):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        stats = self.image_cache.stats()
+        msg = "【图片缓存统计】：\n"
+        msg += f"缓存图片数：{stats['entries']}\n"
+        msg += f"占用：{stats['bytes'] / 1024 / 1024:.2f} / {stats['max_bytes'] / 1024 / 1024:.2f} MB\n"
+        msg += f"命中：{stats['hits']}，未命中：{stats['misses']}\n"
+        msg += f"命中率：{stats['hit_rate']:.1%}\n"
+        url_stats = url_cache.stats()
+        msg += "【图片链接缓存】：\n"
+        msg += f"已记录链接：{url_stats['entries']}\n"
+        msg += f"免下载命中：{url_stats['hits']}，未命中：{url_stats['misses']}"
+        yield event.plain_result(msg)
+
     @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("模糊匹配", alias={"set_fuzzy_match"})
     async def fuzzy_match_command(self, event: AstrMessageEvent, gallery_name: str):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
         
         result = await self.gallery_manager.set_fuzzy(gallery_name, fuzzy=True)
         yield event.plain_result(result)
@@ -463,16 +699,73 @@ class QGCJPlugin(Star):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
         
         result = await self.gallery_manager.set_fuzzy(gallery_name, fuzzy=False)
         yield event.plain_result(result)
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("绑定群", alias={"bind_group"})
+    async def bind_group_command(self, event: AstrMessageEvent, gallery_name: str, group_id: str = ""):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        group_id = str(group_id) or event.get_group_id()
+        if not group_id:
+            yield event.plain_result("请在群聊中使用，或指定群号。")
+            return
+
+        result = await self.gallery_manager.set_groups(gallery_name, gallery.groups + [group_id])
+        yield event.plain_result(result)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("解绑群", alias={"unbind_group"})
+    async def unbind_group_command(self, event: AstrMessageEvent, gallery_name: str, group_id: str = ""):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        # 不指定群号时解除所有绑定，图库的匹配词恢复对所有群生效
+        group_id = str(group_id)
+        if group_id and group_id not in gallery.groups:
+            yield event.plain_result(f"图库【{gallery_name}】未绑定群 {group_id}。")
+            return
+        groups = [g for g in gallery.groups if g != group_id] if group_id else []
+        result = await self.gallery_manager.set_groups(gallery_name, groups)
+        yield event.plain_result(result)
+
     @filter.command("存图")
     async def add_image_command(self, event: AstrMessageEvent, gallery_name: str, label: str = ""):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.config.permission.allow_add and not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -492,12 +785,13 @@ class QGCJPlugin(Star):
                 yield event.plain_result(f"创建图库【{gallery_name}】失败。")
                 return
 
-        image_bytes = await self._get_image(event, reply=True)
-        if image_bytes:
-            if gallery.compress:
-                image_bytes = await compress_image(image_bytes, self.config.add_default.compress_size)
+        fetched = await self._fetch_image(event, reply=True)
+        if fetched:
+            image_bytes, digest = await self._stored_bytes(gallery, fetched)
 
-            result_message = gallery.add_image(image=image_bytes, label=label)
+            result_message = await gallery.add_image(image=image_bytes, label=label, added_by=event.get_sender_id(), digest=digest)
+            self._remember_source(fetched, digest)
+            self.gallery_manager.mark_dirty(gallery.name) # Eviction records live in gallery info
             yield event.plain_result(result_message)
         else:
             yield event.plain_result("请回复或发送图片！")
@@ -507,6 +801,10 @@ class QGCJPlugin(Star):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
         
         if not self.config.permission.allow_del and not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
@@ -517,7 +815,7 @@ class QGCJPlugin(Star):
             yield event.plain_result(f"未找到图库【{gallery_name}】。")
             return
 
-        result_message = gallery.del_image(image_name)
+        result_message = await gallery.del_image(image_name)
         yield event.plain_result(result_message)
 
     @filter.command("查看")
@@ -526,6 +824,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.config.permission.allow_view and not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -536,8 +838,8 @@ class QGCJPlugin(Star):
             return
 
         try:
-            image_path = gallery.get_random_image()
-            yield event.image_result(image_path)
+            image_path = gallery.get_random_image(self._shuffle_scope(event))
+            yield self._image_result(event, gallery, image_path)
         except IndexError:
             yield event.plain_result(f"图库【{gallery_name}】中没有图片。")
 
@@ -547,6 +849,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.config.permission.allow_view and not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -558,7 +864,7 @@ class QGCJPlugin(Star):
         
         msg = "图库列表：\n"
         for g in galleries:
-            msg += f"- {g.name} ({len(g.images)}张图片)\n"
+            msg += f"- {g.name} ({g.count()}张图片)\n"
         yield event.plain_result(msg)
 
     @filter.command("图库详情")
@@ -567,6 +873,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.config.permission.allow_view and not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -581,10 +891,24 @@ class QGCJPlugin(Star):
         msg += f"路径：{info['path']}\n"
         msg += f"创建者：{info['creator_name']} ({info['creator_id']})\n"
         msg += f"容量：{info['capacity']}\n"
-        msg += f"图片数量：{len(gallery.images)}\n"
+        await gallery.sync_catalog()
+        stats = self.gallery_manager.catalog.gallery_stats(gallery.name)
+        msg += f"图片数量：{gallery.count()}\n"
+        msg += f"占用空间：{stats['size'] / 1024 / 1024:.2f} MB\n"
+        msg += f"累计发送：{stats['serves']}次\n"
+        if stats["labels"]:
+            labels = ", ".join(f"{label or '无标签'}({n})" for label, n in stats["labels"])
+            msg += f"标签分布：{labels}\n"
+        if stats["top"]:
+            top_images = ", ".join(f"{name}({n}次)" for name, n in stats["top"])
+            msg += f"最常发送：{top_images}\n"
         msg += f"压缩：{'开启' if info['compress'] else '关闭'}\n"
         msg += f"去重：{'开启' if info['duplicate'] else '关闭'}\n"
+        msg += f"相似去重：{'开启' if info['similar'] else '关闭'} (阈值{info['similar_threshold']})\n"
+        msg += f"存储布局：{'分片' if info['layout'] == 'sharded' else '平铺'}\n"
+        msg += f"满后淘汰：{info['eviction']} (已淘汰{info['evicted_count']}张)\n"
         msg += f"模糊匹配模式：{'开启' if info['fuzzy'] else '关闭'}\n"
+        msg += f"生效的群：{', '.join(info['groups']) if info['groups'] else '所有群'}\n"
         msg += f"精准匹配词：{info['exact_keywords']}\n"
         msg += f"模糊匹配词：{info['fuzzy_keywords']}"
         yield event.plain_result(msg)
@@ -595,6 +919,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -614,8 +942,7 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.add_keyword(keyword, is_fuzzy)
-        self.gallery_manager._save_galleries_info() # Save updated keywords
-        self.gallery_manager._update_keywords()
+        self.gallery_manager.mark_dirty(gallery.name) # Save updated keywords
         yield event.plain_result(result_message)
 
     @filter.command("删除匹配词")
@@ -624,6 +951,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -643,8 +974,7 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.del_keyword(keyword, is_fuzzy)
-        self.gallery_manager._save_galleries_info() # Save updated keywords
-        self.gallery_manager._update_keywords()
+        self.gallery_manager.mark_dirty(gallery.name) # Save updated keywords
         yield event.plain_result(result_message)
 
     @filter.command("设置容量")
@@ -653,6 +983,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -663,7 +997,35 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.set_capacity(capacity)
-        self.gallery_manager._save_galleries_info()
+        self.gallery_manager.mark_dirty(gallery.name)
+        yield event.plain_result(result_message)
+
+    @filter.command("淘汰策略")
+    async def set_eviction_command(self, event: AstrMessageEvent, gallery_name: str, policy: str):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        policy = policy.lower()
+        if policy not in EVICTION_POLICIES:
+            yield event.plain_result(f"淘汰策略只能是 {'/'.join(EVICTION_POLICIES)} 之一。")
+            return
+
+        result_message = gallery.set_eviction(policy)
+        self.gallery_manager.mark_dirty(gallery.name)
         yield event.plain_result(result_message)
 
     @filter.command("打开压缩")
@@ -672,6 +1034,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -682,7 +1048,7 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.set_compress(True)
-        self.gallery_manager._save_galleries_info()
+        self.gallery_manager.mark_dirty(gallery.name)
         yield event.plain_result(result_message)
 
     @filter.command("关闭压缩")
@@ -691,6 +1057,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -701,7 +1071,7 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.set_compress(False)
-        self.gallery_manager._save_galleries_info()
+        self.gallery_manager.mark_dirty(gallery.name)
         yield event.plain_result(result_message)
 
     @filter.command("打开去重")
@@ -710,6 +1080,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -720,7 +1094,7 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.set_duplicate(True)
-        self.gallery_manager._save_galleries_info()
+        self.gallery_manager.mark_dirty(gallery.name)
         yield event.plain_result(result_message)
 
     @filter.command("关闭去重")
@@ -729,6 +1103,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -739,7 +1117,57 @@ class QGCJPlugin(Star):
             return
 
         result_message = gallery.set_duplicate(False)
-        self.gallery_manager._save_galleries_info()
+        self.gallery_manager.mark_dirty(gallery.name)
+        yield event.plain_result(result_message)
+
+    @filter.command("打开相似去重")
+    async def open_similar_command(self, event: AstrMessageEvent, gallery_name: str, threshold: int = -1):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        if threshold > 64:
+            yield event.plain_result("相似阈值必须在0-64之间！")
+            return
+
+        result_message = gallery.set_similar(True, threshold if threshold >= 0 else None)
+        self.gallery_manager.mark_dirty(gallery.name)
+        yield event.plain_result(result_message)
+
+    @filter.command("关闭相似去重")
+    async def close_similar_command(self, event: AstrMessageEvent, gallery_name: str):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        result_message = gallery.set_similar(False)
+        self.gallery_manager.mark_dirty(gallery.name)
         yield event.plain_result(result_message)
 
     @filter.command("去重")
@@ -748,6 +1176,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -757,16 +1189,108 @@ class QGCJPlugin(Star):
             yield event.plain_result(f"未找到图库【{gallery_name}】。")
             return
 
-        result_message = gallery.remove_duplicates()
-        self.gallery_manager._save_galleries_info() # Save changes after removing duplicates
+        async def report_progress(stage: str, done: int, total: int):
+            # Only report progress for large galleries to avoid flooding the chat
+            if total >= DEDUPE_PROGRESS_MIN_FILES:
+                await event.send(event.plain_result(f"图库【{gallery_name}】去重中（{stage}）：{done}/{total}"))
+
+        result_message = await gallery.remove_duplicates(progress=report_progress)
+        self.gallery_manager.mark_dirty(gallery.name) # Save changes after removing duplicates
         yield event.plain_result(result_message)
 
+    @filter.command("迁移图库")
+    async def migrate_gallery_command(self, event: AstrMessageEvent, gallery_name: str):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        result_message = await gallery.migrate_to_sharded()
+        self.gallery_manager.mark_dirty(gallery.name)
+        yield event.plain_result(result_message)
+
+    @filter.command("重新扫描")
+    async def rescan_gallery_command(self, event: AstrMessageEvent, gallery_name: str = ""):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        if gallery_name and not self.gallery_manager.get_gallery(gallery_name):
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        results = await self.gallery_manager.rescan(gallery_name or None)
+        changed = [f"【{name}】新增 {added}，移除 {removed}" for name, (added, removed) in results.items() if added or removed]
+        if changed:
+            yield event.plain_result("重新扫描完成：\n" + "\n".join(changed))
+        else:
+            yield event.plain_result("重新扫描完成，图库没有变动。")
+
+    @filter.command("移动图库")
+    async def move_gallery_command(self, event: AstrMessageEvent, gallery_name: str = "", root_index: int = 0):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        if not gallery_name:
+            lines = ["图库总目录："]
+            for index, stat in enumerate(self.gallery_manager.placer.stats(), 1):
+                count = sum(1 for g in self.gallery_manager.get_all_galleries() if self.gallery_manager.placer.root_of(g.path) == stat["root"])
+                lines.append(f"{index}. {stat['root']}：剩余 {stat['free'] / 1024 ** 3:.1f} GB，{count} 个图库")
+            yield event.plain_result("\n".join(lines))
+            return
+
+        if not self.gallery_manager.get_gallery(gallery_name):
+            yield event.plain_result(f"未找到图库【{gallery_name}】。")
+            return
+
+        root = None
+        if root_index:
+            if not 1 <= root_index <= len(self.gallery_manager.galleries_dirs):
+                yield event.plain_result(f"目录序号应在 1 到 {len(self.gallery_manager.galleries_dirs)} 之间。")
+                return
+            root = self.gallery_manager.galleries_dirs[root_index - 1]
+
+        yield event.plain_result(await self.gallery_manager.move_gallery(gallery_name, root))
+
     @filter.command("路径")
     async def find_path_command(self, event: AstrMessageEvent, gallery_name: str):
         if not self.config.enabled:
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.config.permission.allow_view and not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -786,7 +1310,7 @@ class QGCJPlugin(Star):
         help_text = """
 图库功能命令：
 - 存图 [图库名] [标签]：存储图片到图库 (回复图片消息或直接发送图片)
-- 删图 [图库名] [图片名]：删除图库中的图片
+- 删图 [图库名] [图片名]：删除图库中的图片 (分片布局的图库可用至少8位的哈希前缀)
 - 查看 [图库名]：查看图库中的随机图片
 - 图库列表：查看所有图库
 - 图库详情 [图库名]：查看图库详细信息
@@ -794,15 +1318,27 @@ class QGCJPlugin(Star):
 - 删除匹配词 [精准|模糊] [图库名] [关键词]：删除图库的匹配词
 - 精准匹配词：查看所有精准匹配词
 - 模糊匹配词：查看所有模糊匹配词
+- 绑定群 [图库名] [群号]：图库的匹配词只在绑定的群中生效 (不填群号则绑定当前群)
+- 解绑群 [图库名] [群号]：解除绑定 (不填群号则解除全部，匹配词恢复对所有群生效)
+- 匹配统计：查看关键词匹配预过滤的放行/拦截统计、匹配结果缓存命中率及消息流水线各阶段的耗时
+- 缓存统计：查看热门图片内存缓存的命中率
+- 收集统计：查看自动收集队列的深度、丢弃数与写入数
 - 设置容量 [图库名] [容量]：设置图库的最大容量
+- 淘汰策略 [图库名] [none|fifo|lru|lfu]：图库满时淘汰最早添加/最久未发送/发送最少的图片，none 为拒绝添加
 - 打开压缩 [图库名]：开启图库图片压缩功能
 - 关闭压缩 [图库名]：关闭图库图片压缩功能
 - 打开去重 [图库名]：开启图库图片去重功能
 - 关闭去重 [图库名]：关闭图库图片去重功能
+- 打开相似去重 [图库名] [阈值]：去重时同时跳过相似图片 (缩放、重新压缩过的同一张图)
+- 关闭相似去重 [图库名]：关闭相似图片去重
 - 去重 [图库名]：移除图库中的重复图片
+- 迁移图库 [图库名]：将图库迁移为按内容哈希分片存放的布局
+- 重新扫描 [图库名]：增量扫描图库目录，发现手动放入或删除的图片 (不填图库名则扫描所有已加载的图库)
+- 移动图库 [图库名] [目录序号]：将图库移动到另一个图库总目录 (不填序号则自动选择剩余空间最多的目录，不填图库名则列出各总目录)
 - 路径 [图库名]：获取图库的存储路径
 - 上传图库 [图库名]：上传整个图库为压缩包 (仅支持aiocqhttp)
 - 下载图库 [图库名]：下载图库的压缩包
+- 导入图库 [图库名] [本地路径]：从压缩包批量导入图片 (回复群文件或指定本地路径)
 - 解析：解析图片信息 (回复图片消息或直接发送图片)
 """
         yield event.plain_result(help_text)
@@ -814,6 +1350,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -835,11 +1375,9 @@ class QGCJPlugin(Star):
             return
 
         try:
-            # Compress the gallery into a zip file first
-            import shutil
-            zip_file_path = os.path.join(self.data_dir, f"{gallery_name}.zip")
-            shutil.make_archive(zip_file_path.replace(".zip", ""), 'zip', gallery.path)
-            
+            # Archives are built off the event loop and reused until the gallery changes
+            zip_file_path = await self.gallery_manager.exporter.export(gallery)
+
             # Upload the zip file via aiocqhttp client API
             ret = await event.bot.upload_group_file(group_id=event.get_group_id(), file=zip_file_path, name=f"{gallery_name}.zip")
             if ret.get("retcode") == 0: # Check if upload was successful
@@ -847,8 +1385,6 @@ class QGCJPlugin(Star):
             else:
                 logger.error(f"Upload failed for gallery {gallery_name}: {ret}")
                 yield event.plain_result(f"上传图库【{gallery_name}】失败。错误信息：{ret.get("msg", "未知错误")}")
-            
-            os.remove(zip_file_path) # Clean up the zip file
 
         except Exception as e:
             logger.error(f"上传图库【{gallery_name}】时发生错误: {e}")
@@ -860,6 +1396,10 @@ class QGCJPlugin(Star):
             yield event.plain_result("插件当前已禁用")
             return
 
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
         if not self.context.get_user_is_admin(event.get_sender_id()):
             yield event.plain_result("你没有权限使用此功能。")
             return
@@ -870,25 +1410,80 @@ class QGCJPlugin(Star):
             return
 
         try:
-            # Compress the gallery into a zip file first
-            import shutil
+            # Archives are built off the event loop and reused until the gallery changes
             zip_file_name = f"{gallery_name}.zip"
-            zip_file_path = os.path.join(self.data_dir, zip_file_name)
-            shutil.make_archive(zip_file_path.replace(".zip", ""), 'zip', gallery.path)
-            
+            zip_file_path = await self.gallery_manager.exporter.export(gallery)
+
             # Send the zip file as a message (if platform supports sending local files)
             # This part assumes AstrBot's platform adapter can send local files directly.
             # For some platforms (like QQ Official), sending local files might not be straightforward.
             # For simplicity, we assume event.file_result works for local files.
             yield event.file_result(zip_file_path, name=zip_file_name)
             yield event.plain_result(f"图库【{gallery_name}】已打包发送。")
-            
-            os.remove(zip_file_path) # Clean up the zip file
 
         except Exception as e:
             logger.error(f"下载图库【{gallery_name}】时发生错误: {e}")
             yield event.plain_result(f"下载图库【{gallery_name}】时发生错误：{e}")
 
+    @filter.command("导入图库")
+    async def import_gallery_command(self, event: AstrMessageEvent, gallery_name: str, zip_path: str = ""):
+        if not self.config.enabled:
+            yield event.plain_result("插件当前已禁用")
+            return
+
+        if not await self.gallery_manager.wait_ready():
+            yield event.plain_result("图库正在加载中，请稍后再试。")
+            return
+
+        if not self.context.get_user_is_admin(event.get_sender_id()):
+            yield event.plain_result("你没有权限使用此功能。")
+            return
+
+        if not check_gallery_name(gallery_name) or len(gallery_name) > self.config.add_default.label_max_length:
+            yield event.plain_result("图库名不合法，请重新输入。")
+            return
+
+        # A local path takes precedence; otherwise use the zip file sent or replied to in the chat
+        downloaded = False
+        if zip_path:
+            if not os.path.isfile(zip_path):
+                yield event.plain_result(f"未找到文件【{zip_path}】。")
+                return
+        else:
+            # Uploads go to a dedicated directory under unique temp names, so cleanup never touches plugin data
+            upload_dir = os.path.join(self.data_dir, UPLOAD_DIR_NAME)
+            zip_path = await get_file(
+                event, upload_dir, reply=True, max_size=self.config.gallery_main.max_archive_mb * 1024 * 1024
+            )
+            if not zip_path:
+                yield event.plain_result("请回复或发送图库压缩包，或指定本地压缩包路径！")
+                return
+            downloaded = os.path.dirname(os.path.abspath(zip_path)) == os.path.abspath(upload_dir)
+
+        gallery = self.gallery_manager.get_gallery(gallery_name)
+        if not gallery:
+            gallery = await self._creat_gallery(event, name=gallery_name)
+            if not gallery:
+                yield event.plain_result(f"创建图库【{gallery_name}】失败。")
+                return
+
+        async def report_progress(stage: str, done: int, total: int):
+            if total >= DEDUPE_PROGRESS_MIN_FILES:
+                await event.send(event.plain_result(f"图库【{gallery_name}】{stage}中：{done}/{total}"))
+
+        transform = None
+        if gallery.compress:
+            transform = functools.partial(compress_image_sync, max_size=self.config.add_default.compress_size)
+        try:
+            result_message = await gallery.import_archive(
+                zip_path, transform=transform, added_by=event.get_sender_id(), progress=report_progress
+            )
+        finally:
+            if downloaded and os.path.exists(zip_path):
+                os.remove(zip_path)
+        self.gallery_manager.mark_dirty(gallery.name)
+        yield event.plain_result(result_message)
+
     @filter.command("解析")
     async def parse_command(self, event: AstrMessageEvent):
         if not self.config.enabled:
@@ -908,12 +1503,19 @@ class QGCJPlugin(Star):
             return
         
         try:
-            from io import BytesIO
-            img = Image.open(BytesIO(image_bytes))
-            width, height = img.size
             size = len(image_bytes) # Use length of bytes as approximate size, true size needs file on disk
-            
-            msg = f"图片信息：\n宽度：{width}px\n高度：{height}px\n大小：{size / 1024:.2f} KB"
+            info = probe_image(image_bytes)
+            if info:
+                msg = f"图片信息：\n格式：{info['format']}\n宽度：{info['width']}px\n高度：{info['height']}px\n大小：{size / 1024:.2f} KB"
+                if info["frames"] and info["frames"] > 1:
+                    msg += f"\n帧数：{info['frames']}"
+                if info["orientation"] != 1:
+                    msg += f"\nEXIF方向：{info['orientation']}"
+            else:
+                from io import BytesIO
+                img = Image.open(BytesIO(image_bytes))
+                width, height = img.size
+                msg = f"图片信息：\n宽度：{width}px\n高度：{height}px\n大小：{size / 1024:.2f} KB"
             yield event.plain_result(msg)
 
         except Exception as e:
@@ -41,6 +41,12 @@ class ToolsConfig(BaseModel):
 class GalleryMainConfig(BaseModel):
     """图库主配置"""
     galleries_dirs: List[str] = Field(default=["temp_galleries"], description="图库总目录列表，第一个路径为默认的总目录，自定义的路径请务必使用绝对路径(不要带双引号)")
+    image_cache_mb: int = Field(default=32, description="热门图片内存缓存大小(MB)，发送图片时优先使用缓存，0 表示关闭")
+    max_image_mb: int = Field(default=20, description="下载单张图片的大小上限(MB)，超过时中止下载")
+    max_archive_mb: int = Field(default=500, description="导入图库时下载压缩包的大小上限(MB)")
+    shuffle_per_group: bool = Field(default=False, description="发送图片时是否按群分别轮换(每个群一轮内不重复)，关闭时所有群共用一轮")
+    rescan_interval: int = Field(default=10, description="后台增量扫描已加载图库目录的间隔(分钟)，用于发现手动放入或删除的图片，0 表示关闭")
+    placement: str = Field(default="most_free", description="新图库在多个总目录间的放置策略：first 总是第一个目录，most_free 剩余空间最多的目录，weighted 按剩余空间加权轮流放置")
 
 class UserTriggerConfig(BaseModel):
     """用户消息触发配置"""
@@ -48,6 +54,7 @@ class UserTriggerConfig(BaseModel):
     user_max_msg_len: int = Field(default=30, description="用户消息长度超过此长度时不进行匹配")
     user_exact_prob: float = Field(default=0.9, description="精准匹配用户消息时发送图片的概率")
     user_fuzzy_prob: float = Field(default=0.5, description="模糊匹配用户消息时发送图片的概率")
+    user_fuzzy_policy: str = Field(default="longest", description="用户消息命中多个模糊匹配词时的优先策略: longest 最长匹配优先, first 最先出现优先")
 
 class LLMTriggerConfig(BaseModel):
     """LLM消息触发配置"""
@@ -55,12 +62,17 @@ class LLMTriggerConfig(BaseModel):
     llm_max_msg_len: int = Field(default=20, description="LLM消息长度超过此长度时不响应")
     llm_exact_prob: float = Field(default=0.9, description="精准匹配LLM消息时发送图片的概率")
     llm_fuzzy_prob: float = Field(default=0.9, description="模糊匹配LLM消息时发送图片的概率")
+    llm_fuzzy_policy: str = Field(default="longest", description="LLM消息命中多个模糊匹配词时的优先策略: longest 最长匹配优先, first 最先出现优先")
 
 class AddDefaultConfig(BaseModel):
     """添加图片时默认配置"""
     default_compress: bool = Field(default=True, description="下载图片时是否压缩图片")
     compress_size: int = Field(default=512, description="压缩阈值(单位为像素)，图片在512像素以下时qq以表情包大小显示")
     default_duplicate: bool = Field(default=True, description="添加图片时是否检查并跳过重复图片")
+    default_similar: bool = Field(default=False, description="去重时是否同时跳过相似图片(感知哈希)，如缩放、重新压缩过的同一张图")
+    similar_threshold: int = Field(default=6, description="相似图片的汉明距离阈值(0-64)，越小越严格")
+    default_eviction: str = Field(default="none", description="图库满时的淘汰策略：none 拒绝添加，fifo 淘汰最早添加的，lru 淘汰最久未发送的，lfu 淘汰发送次数最少的")
+    default_layout: str = Field(default="flat", description="新图库的存储布局：flat 按 标签_序号 平铺，sharded 按内容哈希分片存放")
     default_fuzzy: bool = Field(default=False, description="是否默认模糊匹配")
     label_max_length: int = Field(default=4, description="允许的图库名、图片名的最大长度")
     default_capacity: int = Field(default=200, description="图库的默认容量")
@@ -76,6 +88,18 @@ class AutoCollectConfig(BaseModel):
     enable_collect: bool = Field(default=False, description="是否启用自动收集功能")
     white_list: List[str] = Field(default=[], description="自动收集的群聊白名单, 留空表示启用所有群聊")
     collect_compressed_img: bool = Field(default=False, description="收集的图片大小限制(MB)")
+    queue_size: int = Field(default=64, description="自动收集队列长度上限，队列满时新图片直接丢弃")
+    workers: int = Field(default=2, description="自动收集的并发下载数")
+    batch_size: int = Field(default=8, description="自动收集攒够多少张图片后一次写入")
+    group_rate_per_minute: float = Field(default=20, description="每个群每分钟最多收集的图片数")
+    group_burst: int = Field(default=5, description="每个群允许的突发收集数")
+    collect_eviction: str = Field(default="fifo", description="自动收集图库满时的淘汰策略(none/fifo/lru/lfu)，none 表示满后停止收集")
+
+class ModerationConfig(BaseModel):
+    """消息审核配置"""
+    enabled: bool = Field(default=False, description="是否启用敏感词审核，命中的消息不再触发图库匹配与自动收集")
+    sensitive_words: List[str] = Field(default=[], description="敏感词列表")
+    warn: bool = Field(default=True, description="命中敏感词时是否发送警告")
 
 class QGCJConfig(BaseModel):
     """插件总配置"""
@@ -89,6 +113,7 @@ class QGCJConfig(BaseModel):
     add_default: AddDefaultConfig = Field(default_factory=AddDefaultConfig, description="添加图片时默认配置")
     permission: PermissionConfig = Field(default_factory=PermissionConfig, description="权限配置")
     auto_collect: AutoCollectConfig = Field(default_factory=AutoCollectConfig, description="自动收集配置")
+    moderation: ModerationConfig = Field(default_factory=ModerationConfig, description="消息审核配置")
     api_keys: Dict[str, str] = Field(
         default={
             "netease_music": "",
@@ -0,0 +1,237 @@
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from astrbot import logger
+
+# 发送记录攒够此数量才写入一次，读取发送统计或改动路径前也会先写入
+SERVE_BATCH_SIZE = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    gallery TEXT NOT NULL,
+    label TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL DEFAULT 0,
+    width INTEGER NOT NULL DEFAULT 0,
+    height INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    phash INTEGER,
+    added_at REAL NOT NULL,
+    added_by TEXT NOT NULL DEFAULT '',
+    serve_count INTEGER NOT NULL DEFAULT 0,
+    last_served REAL
+);
+CREATE INDEX IF NOT EXISTS idx_images_gallery ON images (gallery);
+CREATE INDEX IF NOT EXISTS idx_images_gallery_label ON images (gallery, label);
+CREATE INDEX IF NOT EXISTS idx_images_hash ON images (content_hash);
+"""
+
+
+def _to_signed(phash: Optional[int]) -> Optional[int]:
+    # SQLite 的 INTEGER 为有符号 64 位
+    if phash is None:
+        return None
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+
+def label_from_name(name: str) -> str:
+    """
+    从文件名(标签_序号.jpg)中解析标签
+    """
+    stem = os.path.splitext(name)[0]
+    return stem.rsplit("_", 1)[0] if "_" in stem else ""
+
+
+class ImageCatalog:
+    """
+    所有图库共享的 SQLite 图片目录(WAL 模式)，每张图片一行
+    """
+
+    def __init__(self, db_file: str):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self.db_file = db_file
+        self._conn = sqlite3.connect(db_file)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        # 尚未写入的发送记录 (发送时间, 路径)
+        self._pending_serves: List[Tuple[float, str]] = []
+
+    def add_images(self, rows: Iterable[dict]):
+        """
+        批量登记图片，单个事务提交
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO images (path, gallery, label, size, width, height, content_hash, phash, added_at, added_by) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        row["path"], row["gallery"], row.get("label", ""), row.get("size", 0),
+                        row.get("width", 0), row.get("height", 0), row.get("content_hash"),
+                        _to_signed(row.get("phash")), row.get("added_at", now), row.get("added_by", ""),
+                    )
+                    for row in rows
+                ],
+            )
+
+    def remove_image(self, path: str):
+        """
+        移除图片记录
+        """
+        with self._conn:
+            self._conn.execute("DELETE FROM images WHERE path = ?", (path,))
+
+    def remove_images(self, paths: Iterable[str]):
+        """
+        批量移除图片记录
+        """
+        with self._conn:
+            self._conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in paths])
+
+    def remove_gallery(self, gallery: str):
+        """
+        移除图库的全部记录
+        """
+        with self._conn:
+            self._conn.execute("DELETE FROM images WHERE gallery = ?", (gallery,))
+
+    def count(self, gallery: str) -> int:
+        """
+        统计图库中的图片数量
+        """
+        return self._conn.execute("SELECT COUNT(*) FROM images WHERE gallery = ?", (gallery,)).fetchone()[0]
+
+    def paths(self, gallery: str) -> List[str]:
+        """
+        获取图库中所有图片路径
+        """
+        return [row[0] for row in self._conn.execute("SELECT path FROM images WHERE gallery = ?", (gallery,))]
+
+    def paths_by_hash(self, content_hash: str) -> List[str]:
+        """
+        按内容哈希查找所有图库中的图片路径
+        """
+        rows = self._conn.execute("SELECT path FROM images WHERE content_hash = ?", (content_hash,))
+        return [row[0] for row in rows]
+
+    def labels(self, gallery: str) -> Dict[str, str]:
+        """
+        获取图库中 路径 -> 标签
+        """
+        rows = self._conn.execute("SELECT path, label FROM images WHERE gallery = ?", (gallery,))
+        return {path: label for path, label in rows}
+
+    def move_images(self, moves: Iterable[Tuple[str, str]]):
+        """
+        批量更新图片路径(旧路径, 新路径)，目标已登记时删除旧记录
+        """
+        self.flush_serves()
+        with self._conn:
+            for old, new in moves:
+                if self._conn.execute("SELECT 1 FROM images WHERE path = ?", (new,)).fetchone():
+                    self._conn.execute("DELETE FROM images WHERE path = ?", (old,))
+                else:
+                    self._conn.execute("UPDATE images SET path = ? WHERE path = ?", (new, old))
+
+    def relocate(self, gallery: str, old_path: str, new_path: str):
+        """
+        图库目录整体移动后，在一个事务内替换该图库所有图片路径的目录前缀
+        """
+        prefix = os.path.join(old_path, "")
+        self.flush_serves()
+        with self._conn:
+            self._conn.execute(
+                "UPDATE images SET path = ? || substr(path, ?) WHERE gallery = ? AND substr(path, 1, ?) = ?",
+                (os.path.join(new_path, ""), len(prefix) + 1, gallery, len(prefix), prefix),
+            )
+
+    def serve_stats(self, gallery: str) -> List[Tuple[str, float, int, Optional[float]]]:
+        """
+        获取图库中每张图片的 (路径, 添加时间, 发送次数, 最后发送时间)
+        """
+        self.flush_serves()
+        return self._conn.execute(
+            "SELECT path, added_at, serve_count, last_served FROM images WHERE gallery = ?", (gallery,)
+        ).fetchall()
+
+    def record_serve(self, path: str):
+        """
+        记录一次发送，攒批写入，不在每次发图时提交事务
+        """
+        self._pending_serves.append((time.time(), path))
+        if len(self._pending_serves) >= SERVE_BATCH_SIZE:
+            self.flush_serves()
+
+    def flush_serves(self):
+        """
+        写入尚未提交的发送记录
+        """
+        if not self._pending_serves:
+            return
+        pending, self._pending_serves = self._pending_serves, []
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE images SET serve_count = serve_count + 1, last_served = ? WHERE path = ?", pending
+            )
+
+    def gallery_stats(self, gallery: str) -> Dict:
+        """
+        获取图库统计：数量、总大小、标签分布与发送最多的图片
+        """
+        self.flush_serves()
+        count, total_size, serves = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(serve_count), 0) FROM images WHERE gallery = ?",
+            (gallery,),
+        ).fetchone()
+        labels = self._conn.execute(
+            "SELECT label, COUNT(*) FROM images WHERE gallery = ? GROUP BY label ORDER BY COUNT(*) DESC LIMIT 5",
+            (gallery,),
+        ).fetchall()
+        top = self._conn.execute(
+            "SELECT path, serve_count FROM images WHERE gallery = ? AND serve_count > 0 ORDER BY serve_count DESC LIMIT 3",
+            (gallery,),
+        ).fetchall()
+        return {
+            "count": count,
+            "size": total_size,
+            "serves": serves,
+            "labels": labels,
+            "top": [(os.path.basename(path), n) for path, n in top],
+        }
+
+    def reconcile(self, gallery: str, paths: List[str], rows_for: Callable[[List[str]], Iterable[dict]]) -> Tuple[int, int]:
+        """
+        将目录与文件系统对齐：补登记缺失的图片，删除已不存在的记录
+        Args:
+            gallery: 图库名
+            paths: 文件系统中的图片路径
+            rows_for: 为缺失的路径生成登记行的函数
+
+        Returns:
+            (新增数, 删除数)
+        """
+        known = set(self.paths(gallery))
+        current = set(paths)
+        missing = [p for p in paths if p not in known]
+        stale = known - current
+        if missing:
+            self.add_images(rows_for(missing))
+        if stale:
+            self.remove_images(stale)
+        if missing or stale:
+            logger.info(f"图库【{gallery}】目录已对齐: 新增 {len(missing)}，删除 {len(stale)}")
+        return len(missing), len(stale)
+
+    def close(self):
+        """
+        关闭数据库连接
+        """
+        try:
+            self.flush_serves()
+            self._conn.close()
+        except Exception as e:
+            logger.error(f"关闭图片目录数据库失败: {e}")
@@ -0,0 +1,129 @@
+import asyncio
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from astrbot import logger
+from data.plugins.qgcj.core.hash_index import hash_file
+from data.plugins.qgcj.core.phash import dhash
+
+T = TypeVar("T")
+
+# 进度回调: (阶段, 已完成数, 总数)
+ProgressCallback = Callable[[str, int, int], Awaitable[None]]
+
+
+async def map_in_pool(
+    func: Callable[[str], T],
+    paths: List[str],
+    max_workers: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    stage: str = "",
+) -> Dict[str, T]:
+    """
+    在线程池中并行处理文件，不阻塞事件循环
+    Args:
+        func: 处理单个文件的函数
+        paths: 文件路径列表
+        max_workers: 线程数，默认为 CPU 核心数
+        progress: 进度回调，约每完成 10% 调用一次
+        stage: 进度回调中的阶段名
+
+    Returns:
+        Dict[str, T]: 路径 -> 处理结果，失败的文件不包含在内
+    """
+    results: Dict[str, T] = {}
+    if not paths:
+        return results
+
+    loop = asyncio.get_running_loop()
+    total = len(paths)
+    step = max(1, total // 10)
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 4) as pool:
+
+        async def run(path: str) -> Tuple[str, T]:
+            return path, await loop.run_in_executor(pool, func, path)
+
+        done = 0
+        for future in asyncio.as_completed([run(path) for path in paths]):
+            done += 1
+            try:
+                path, result = await future
+                results[path] = result
+            except Exception as e:
+                logger.warning(f"{stage}处理文件失败: {e}")
+            if progress and (done % step == 0 or done == total):
+                await progress(stage, done, total)
+    return results
+
+
+def _stat_files(paths: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            continue
+    return stats
+
+
+def _phash_file(path: str) -> int:
+    with open(path, "rb") as f:
+        return dhash(f.read())
+
+
+async def scan_duplicates(
+    image_paths: List[str],
+    entries: Dict[str, dict],
+    similar: bool = False,
+    max_workers: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> Tuple[List[List[str]], Dict[str, dict]]:
+    """
+    流式扫描重复图片：先按文件大小分组，只对大小相同的文件分块计算哈希
+    Args:
+        image_paths: 图片路径列表
+        entries: 哈希索引中已有的条目(文件名 -> 条目)，未过期的条目直接复用
+        similar: 是否需要补齐所有图片的感知哈希
+        max_workers: 线程数
+        progress: 进度回调
+
+    Returns:
+        (重复组列表, 新计算出的索引条目)
+    """
+    loop = asyncio.get_running_loop()
+    stats = await loop.run_in_executor(None, _stat_files, image_paths)
+
+    fresh: Dict[str, dict] = {}
+    by_size: Dict[int, List[str]] = defaultdict(list)
+    for path, (size, mtime) in stats.items():
+        entry = entries.get(os.path.basename(path))
+        if entry and entry.get("size") == size and entry.get("mtime") == mtime:
+            fresh[path] = entry
+        by_size[size].append(path)
+
+    candidates = [p for group in by_size.values() if len(group) > 1 for p in group]
+    to_hash = [p for p in (stats if similar else candidates) if p not in fresh]
+    digests = await map_in_pool(hash_file, to_hash, max_workers, progress, "哈希")
+
+    updated: Dict[str, dict] = {}
+    for path, digest in digests.items():
+        size, mtime = stats[path]
+        updated[path] = {"size": size, "mtime": mtime, "hash": digest}
+
+    if similar:
+        known = {**fresh, **updated}
+        to_phash = [p for p, e in known.items() if e.get("phash") is None]
+        phashes = await map_in_pool(_phash_file, to_phash, max_workers, progress, "感知哈希")
+        for path, phash in phashes.items():
+            updated[path] = dict(known[path], phash=phash)
+
+    groups: Dict[str, List[str]] = defaultdict(list)
+    for path in candidates:
+        entry = updated.get(path) or fresh.get(path)
+        if entry:
+            groups[entry["hash"]].append(path)
+
+    duplicate_groups = [sorted(g) for g in groups.values() if len(g) > 1]
+    return duplicate_groups, {os.path.basename(p): e for p, e in updated.items()}
@@ -0,0 +1,90 @@
+import heapq
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EVICTION_POLICIES = ("none", "fifo", "lru", "lfu")
+# 图库信息中保留的最近淘汰记录条数
+EVICTION_LOG_SIZE = 20
+
+
+class EvictionHeap:
+    """
+    容量淘汰优先队列：堆顶为最应淘汰的图片
+    fifo 按添加时间，lru 按最后发送时间，lfu 按发送次数(相同时按最后发送时间)
+    更新采用惰性删除：推入新键，弹出时丢弃与当前键不一致的旧条目
+    """
+
+    def __init__(self, policy: str):
+        self.policy = policy
+        self._heap: List[Tuple[tuple, str]] = []
+        # 路径 -> [添加时间, 发送次数, 最后发送时间]
+        self._stats: Dict[str, list] = {}
+        self._keys: Dict[str, tuple] = {}
+
+    def load(self, rows: Iterable[Tuple[str, float, int, Optional[float]]]):
+        """
+        批量载入 (路径, 添加时间, 发送次数, 最后发送时间)
+        """
+        for path, added_at, serve_count, last_served in rows:
+            self._stats[path] = [added_at, serve_count, last_served]
+            self._keys[path] = self._key(path)
+        self._heap = [(key, path) for path, key in self._keys.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, path: str, added_at: Optional[float] = None):
+        """
+        登记新图片
+        """
+        self._stats[path] = [added_at or time.time(), 0, None]
+        self._push(path)
+
+    def touch(self, path: str):
+        """
+        记录一次发送
+        """
+        stats = self._stats.get(path)
+        if stats is None:
+            return
+        stats[1] += 1
+        stats[2] = time.time()
+        # fifo 不受发送影响，无需更新堆
+        if self.policy != "fifo":
+            self._push(path)
+
+    def remove(self, path: str):
+        """
+        移除图片，堆中的旧条目在弹出时跳过
+        """
+        self._stats.pop(path, None)
+        self._keys.pop(path, None)
+
+    def pop(self) -> Optional[str]:
+        """
+        弹出最应淘汰的图片
+        """
+        while self._heap:
+            key, path = heapq.heappop(self._heap)
+            if self._keys.get(path) == key:
+                self.remove(path)
+                return path
+        return None
+
+    def _key(self, path: str) -> tuple:
+        added_at, serve_count, last_served = self._stats[path]
+        if self.policy == "lru":
+            return (last_served or added_at,)
+        if self.policy == "lfu":
+            return (serve_count, last_served or added_at)
+        return (added_at,)
+
+    def _push(self, path: str):
+        key = self._key(path)
+        self._keys[path] = key
+        heapq.heappush(self._heap, (key, path))
+        # 过期条目过多时重建堆，避免频繁发送的图库堆无限增长
+        if len(self._heap) > 2 * len(self._keys) + 64:
+            self._heap = [(k, p) for p, k in self._keys.items()]
+            heapq.heapify(self._heap)
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import zipfile
+from typing import Dict, List, Optional, Tuple
+from astrbot import logger
+
+# 已压缩过的格式直接存储，重复压缩只会浪费 CPU
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip", ".mp4"}
+
+
+def write_archive(files: List[Tuple[str, str]], zip_file: str) -> int:
+    """
+    将文件逐个流式写入压缩包，写完后原子地替换目标文件
+    Args:
+        files: (文件路径, 压缩包内路径)
+        zip_file: 目标压缩包路径
+
+    Returns:
+        int: 写入的文件数
+    """
+    tmp_file = f"{zip_file}.tmp"
+    written = 0
+    with zipfile.ZipFile(tmp_file, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for path, arcname in files:
+            ext = os.path.splitext(path)[1].lower()
+            compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            try:
+                zf.write(path, arcname, compress_type=compress_type)
+            except OSError as e:
+                logger.warning(f"打包时跳过文件【{path}】: {e}")
+                continue
+            written += 1
+    os.replace(tmp_file, zip_file)
+    return written
+
+
+class GalleryExporter:
+    """
+    图库压缩包导出器：在线程中打包，按图库版本缓存产物，同一图库的并发导出共享一次打包
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        # 图库名 -> (图库版本, 压缩包路径)
+        self._cached: Dict[str, Tuple[int, str]] = {}
+        self._builds: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._clear_stale()
+
+    def _clear_stale(self):
+        """
+        清理上次运行留下的压缩包：图库版本只保存在内存中，重启后旧产物不会再被复用或删除
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith((".zip", ".zip.tmp")):
+                self._remove(entry.path)
+
+    async def export(self, gallery) -> str:
+        """
+        获取图库的压缩包路径，图库未变更时直接复用上次的产物
+        """
+        version = gallery.version
+        cached = self._cached.get(gallery.name)
+        if cached and cached[0] == version and os.path.exists(cached[1]):
+            return cached[1]
+
+        key = (gallery.name, version)
+        build = self._builds.get(key)
+        if build is None:
+            build = asyncio.ensure_future(self._build(gallery, version))
+            self._builds[key] = build
+            build.add_done_callback(lambda _: self._builds.pop(key, None))
+        # 单个请求被取消时不影响其他等待同一次打包的请求
+        return await asyncio.shield(build)
+
+    async def _build(self, gallery, version: int) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = gallery.archive_entries()
+        zip_file = os.path.join(self.cache_dir, f"{gallery.name}.{version}.zip")
+        written = await asyncio.to_thread(write_archive, files, zip_file)
+        logger.info(f"图库【{gallery.name}】已打包 {written} 个文件")
+
+        previous = self._cached.get(gallery.name)
+        if previous and previous[0] < version:
+            self._remove(previous[1])
+        if not previous or previous[0] <= version:
+            self._cached[gallery.name] = (version, zip_file)
+        return zip_file
+
+    def forget(self, name: str):
+        """
+        删除图库的缓存压缩包
+        """
+        cached = self._cached.pop(name, None)
+        if cached:
+            self._remove(cached[1])
+
+    def _remove(self, zip_file: Optional[str]):
+        try:
+            if zip_file and os.path.exists(zip_file):
+                os.remove(zip_file)
+        except OSError as e:
+            logger.warning(f"删除缓存压缩包【{zip_file}】失败: {e}")
@@ -1,10 +1,38 @@
+import asyncio
+import json
 import os
-import random
 import shutil
-from typing import List
+import time
+import zipfile
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from astrbot import logger
 from astrbot.core.platform.message_components import Image
 from data.plugins.qgcj.core.parse import get_image_info
+from data.plugins.qgcj.core.hash_index import HashIndex, hash_bytes, hash_file
+from data.plugins.qgcj.core.phash import BKTree, dhash
+from data.plugins.qgcj.core.dedupe import ProgressCallback, map_in_pool, scan_duplicates
+from data.plugins.qgcj.core.keyword_scope import ScopedKeywordIndex
+from data.plugins.qgcj.core.catalog import ImageCatalog, label_from_name
+from data.plugins.qgcj.core.probe import PROBE_HEAD_SIZE, probe_cache, probe_image
+from data.plugins.qgcj.core.importer import iter_archive_images, list_archive_images
+from data.plugins.qgcj.core.shuffle import ShuffleBags
+from data.plugins.qgcj.core.eviction import EVICTION_LOG_SIZE, EvictionHeap
+from data.plugins.qgcj.core.placement import move_tree
+
+
+# sharded 布局下按图片格式选择扩展名
+SHARDED_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+
+def _atomic_write(path: str, data: bytes):
+    """
+    先写入临时文件再重命名，避免写入中断留下半个文件
+    """
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
 
 
 class Gallery:
@@ -12,7 +40,7 @@ class Gallery:
     图库类
     """
 
-    def __init__(self, gallery_info: dict):
+    def __init__(self, gallery_info: dict, manifest_file: Optional[str] = None, hash_index_file: Optional[str] = None):
         self.name: str = gallery_info["name"]
         self.path: str = gallery_info["path"]
         self.creator_id: str = gallery_info["creator_id"]
@@ -21,53 +49,730 @@ class Gallery:
         self.compress: bool = gallery_info["compress"]
         self.duplicate: bool = gallery_info["duplicate"]
         self.fuzzy: bool = gallery_info["fuzzy"]
+        self.similar: bool = gallery_info.get("similar", False)
+        self.similar_threshold: int = gallery_info.get("similar_threshold", 6)
         self.exact_keywords: List[str] = gallery_info.get("exact_keywords", [])
         self.fuzzy_keywords: List[str] = gallery_info.get("fuzzy_keywords", [])
-        self.images: List[str] = [
-            os.path.join(self.path, f) for f in os.listdir(self.path)
-        ]
+        # 绑定的群号，为空时关键词对所有群生效
+        self.groups: List[str] = gallery_info.get("groups", [])
+        # flat: 图片以 标签_序号.jpg 平铺在图库目录；sharded: 按内容哈希分两级子目录存放
+        self.layout: str = gallery_info.get("layout", "flat")
+        # 图库满时的淘汰策略：none 拒绝添加，fifo/lru/lfu 淘汰一张旧图
+        self.eviction: str = gallery_info.get("eviction", "none")
+        self.evicted_count: int = gallery_info.get("evicted_count", 0)
+        self.recent_evictions: List[dict] = gallery_info.get("recent_evictions", [])
         self.image_info: dict = {}
+        self._images: Optional[List[str]] = None
+        # 图片路径 -> 在图片列表中的下标，增删时与末尾元素交换，均为 O(1)
+        self._image_pos: Dict[str, int] = {}
+        self._manifest_file = manifest_file
+        self._dir_snapshot: Optional[Dict[str, int]] = None
+        self._manifest_dirty = False
+        self._version = 0
+        self._shuffle_bags = ShuffleBags()
+        self._eviction_heap: Optional[EvictionHeap] = None
+        self._hash_index_file = hash_index_file
+        self._hash_index = HashIndex(self.path, hash_index_file)
+        self._bk_tree: Optional[BKTree] = None
+        # 所有写入图片文件的操作都持有此锁；去重、迁移、移动、导入等耗时操作期间记录操作名称
+        self._write_lock = asyncio.Lock()
+        self._busy: Optional[str] = None
+        # 图库已被删除；删除前排队等待写锁的写入不再落盘
+        self.deleted = False
+        self._keyword_index: Optional[ScopedKeywordIndex] = None
+        self._catalog: Optional[ImageCatalog] = None
+        self._catalog_synced = False
+
+    @property
+    def images(self) -> List[str]:
+        """
+        图片路径列表，首次访问时才从清单或目录加载
+        """
+        if self._images is None:
+            self._load_images()
+        return self._images
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        图片列表是否已加载
+        """
+        return self._images is not None
 
-    def get_random_image(self) -> str:
+    def _load_images(self) -> List[str]:
         """
-        随机获取图片
+        从清单加载图片列表，仅重新扫描修改时间与清单快照不一致的目录
         """
-        return random.choice(self.images)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        images: List[str] = []
+        dirs: Dict[str, int] = {}
+        if self._manifest_file and os.path.exists(self._manifest_file):
+            try:
+                with open(self._manifest_file, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                images = [os.path.join(self.path, rel) for rel in manifest["images"]]
+                # 旧版清单只记录了图库目录本身的修改时间
+                dirs = manifest.get("dirs") or {".": manifest.get("mtime")}
+            except Exception as e:
+                logger.warning(f"图库【{self.name}】清单损坏，将重新扫描: {e}")
+                images, dirs = [], {}
+
+        new_dirs, changed = self._scan_changes(dirs)
+        images, _, _ = self._apply_scan(images, dirs, new_dirs, changed)
+        self._set_images(images)
+        self._dir_snapshot = new_dirs
+        if changed or new_dirs != dirs:
+            self._mark_changed()
+            self.save_manifest()
+        return images
+
+    def _set_images(self, images: List[str]):
+        """
+        整体替换图片列表，以旧路径为键的抽取袋随之重建
+        """
+        self._images = images
+        self._image_pos = {image_path: index for index, image_path in enumerate(images)}
+        self._shuffle_bags = ShuffleBags()
+
+    def _append_image(self, image_path: str) -> bool:
+        if image_path in self._image_pos:
+            return False
+        self._image_pos[image_path] = len(self._images)
+        self._images.append(image_path)
+        self._shuffle_bags.add(image_path)
+        return True
+
+    def _discard_image(self, image_path: str) -> bool:
+        index = self._image_pos.pop(image_path, None)
+        if index is None:
+            return False
+        last = self._images.pop()
+        if index < len(self._images):
+            self._images[index] = last
+            self._image_pos[last] = index
+        self._shuffle_bags.discard(image_path)
+        return True
+
+    def _scan_changes(self, dirs: Dict[str, int]) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        """
+        按目录修改时间快照增量扫描：修改时间未变的目录不列出文件，只检查其子目录
+        Args:
+            dirs: 上次的目录快照(相对路径 -> 修改时间)
+
+        Returns:
+            (新的目录快照, 有变动的目录 -> 目录中的图片路径)
+        """
+        max_depth = 2 if self.layout == "sharded" else 0
+        children: Dict[str, List[str]] = {}
+        for rel in dirs:
+            if rel != ".":
+                children.setdefault(os.path.dirname(rel) or ".", []).append(rel)
+
+        new_dirs: Dict[str, int] = {}
+        changed: Dict[str, List[str]] = {}
+        stack = [(".", 0)]
+        while stack:
+            rel, depth = stack.pop()
+            abs_dir = self.path if rel == "." else os.path.join(self.path, rel)
+            try:
+                mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            new_dirs[rel] = mtime
+            if dirs.get(rel) == mtime:
+                # 目录内容未变：子目录集合也未变，只需继续检查子目录本身
+                if depth < max_depth:
+                    stack.extend((child, depth + 1) for child in children.get(rel, []))
+                continue
+            files = []
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth < max_depth:
+                            stack.append((entry.name if rel == "." else os.path.join(rel, entry.name), depth + 1))
+                    else:
+                        files.append(entry.path)
+            changed[rel] = files
+        return new_dirs, changed
+
+    def _apply_scan(
+        self,
+        images: List[str],
+        old_dirs: Dict[str, int],
+        new_dirs: Dict[str, int],
+        changed: Dict[str, List[str]],
+    ) -> Tuple[List[str], List[str], List[str]]:
+        """
+        用增量扫描结果替换有变动目录中的图片
+        Returns:
+            (新的图片列表, 新增的图片, 移除的图片)
+        """
+        stale = set(changed) | (set(old_dirs) - set(new_dirs))
+        if not stale:
+            return images, [], []
+        kept = [p for p in images if self._rel_dir(p) not in stale]
+        fresh = [p for files in changed.values() for p in files]
+        old_set = set(images)
+        new_images = kept + fresh
+        new_set = set(new_images)
+        added = [p for p in fresh if p not in old_set]
+        removed = [p for p in images if p not in new_set]
+        return new_images, added, removed
+
+    def _rel_dir(self, image_path: str) -> str:
+        return os.path.relpath(os.path.dirname(image_path), self.path)
+
+    async def rescan(self) -> Tuple[int, int]:
+        """
+        增量重新扫描图库目录，同步图片列表、哈希索引与图片目录
+        Returns:
+            (新增数, 移除数)
+        """
+        async with self._write_lock:
+            if self.deleted:
+                return 0, 0
+            return await self._rescan()
+
+    async def _rescan(self) -> Tuple[int, int]:
+        if self._images is None:
+            # 尚未加载的图库在加载时即会增量扫描
+            self._load_images()
+            return 0, 0
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        old_dirs = self._dir_snapshot or {}
+        new_dirs, changed = await asyncio.to_thread(self._scan_changes, old_dirs)
+        _, added, removed = self._apply_scan(self._images, old_dirs, new_dirs, changed)
+        self._dir_snapshot = new_dirs
+        if not added and not removed:
+            if new_dirs != old_dirs:
+                self._manifest_dirty = True
+            return 0, 0
+
+        for image_path in removed:
+            self._discard_image(image_path)
+        for image_path in added:
+            self._append_image(image_path)
+        self._mark_changed()
+        self._bk_tree = None
+        self._eviction_heap = None
+        if self._hash_index.loaded:
+            for image_path in removed:
+                self._hash_index.remove(image_path, save=False)
+            digests = await map_in_pool(hash_file, added, stage="重新扫描")
+            for image_path, digest in digests.items():
+                self._hash_index.add(image_path, digest, save=False)
+            self._hash_index.save()
+        if self._catalog and self._catalog_synced:
+            self._catalog.remove_images(removed)
+            self._catalog.add_images(self._catalog_rows(added))
+        self.save_manifest()
+        logger.info(f"图库【{self.name}】重新扫描: 新增 {len(added)}，移除 {len(removed)}")
+        return len(added), len(removed)
+
+    @property
+    def version(self) -> int:
+        """
+        图片集合的版本号，图片增删时递增，用于判断依赖图片列表的缓存是否过期
+        """
+        return self._version
+
+    def _mark_changed(self, image_path: Optional[str] = None):
+        self._manifest_dirty = True
+        self._version += 1
+        if image_path and self._dir_snapshot is not None:
+            # 自身写入引起的目录变动直接计入快照，下次扫描无需重新列出
+            abs_dir = os.path.dirname(image_path)
+            while True:
+                try:
+                    self._dir_snapshot[os.path.relpath(abs_dir, self.path)] = os.stat(abs_dir).st_mtime_ns
+                except OSError:
+                    pass
+                if os.path.normpath(abs_dir) == os.path.normpath(self.path):
+                    break
+                abs_dir = os.path.dirname(abs_dir)
 
-    def add_image(self, image: bytes, label: str = "") -> str:
+    def save_manifest(self):
+        """
+        图片列表有变动时，保存图片清单及目录修改时间快照
+        """
+        if not self._manifest_file or self._images is None or not self._manifest_dirty:
+            return
+        if not os.path.exists(self.path):
+            return
+        manifest = {
+            "dirs": self._dir_snapshot or {},
+            "images": [os.path.relpath(p, self.path) for p in self._images],
+        }
+        tmp_file = f"{self._manifest_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self._manifest_file), exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(tmp_file, self._manifest_file)
+            self._manifest_dirty = False
+        except Exception as e:
+            logger.error(f"保存图库【{self.name}】清单失败: {e}")
+
+    def get_random_image(self, scope: Optional[str] = None) -> str:
+        """
+        随机获取图片，一轮内不重复
+        Args:
+            scope: 抽取作用域(如群号)，不同作用域各自独立轮换，为空时使用全局轮换
+
+        Raises:
+            IndexError: 图库中没有图片
+        """
+        return self._shuffle_bags.get(scope).draw(self.images)
+
+    def count(self) -> int:
+        """
+        图片数量，目录已与文件系统对齐时直接查询目录
+        """
+        if self._catalog and self._catalog_synced:
+            return self._catalog.count(self.name)
+        return len(self.images)
+
+    async def add_image(self, image: bytes, label: str = "", added_by: str = "", digest: Optional[str] = None) -> str:
         """
         添加图片
+        Args:
+            digest: 下载时已算好的内容哈希，省去再次哈希
+        """
+        return (await self.add_images([(image, label, added_by, digest)]))[0]
+
+    async def add_images(self, items: List[Tuple[bytes, str, str, Optional[str]]]) -> List[str]:
+        """
+        批量添加图片，哈希索引与图片目录在最后一次写入；图库正在移动或迁移时等待其完成
+        Args:
+            items: (图片字节流, 标签, 添加者, 内容哈希或 None)
+
+        Returns:
+            List[str]: 每张图片的处理结果
+        """
+        async with self._write_lock:
+            if self.deleted:
+                return [f"图库【{self.name}】已删除。"] * len(items)
+            if self.duplicate:
+                await self._load_hash_index()
+            await self._prepare_eviction()
+            return self._add_images(items)
+
+    def _add_images(self, items: List[Tuple[bytes, str, str, Optional[str]]]) -> List[str]:
+        results = []
+        rows = []
+        index_dirty = False
+        evicted_before = self.evicted_count
+        for image, label, added_by, digest in items:
+            digest = digest or hash_bytes(image)
+            phash = None
+            if self.duplicate:
+                if self._hash_index.contains(digest):
+                    results.append(f"图片已存在于图库【{self.name}】，已跳过。")
+                    continue
+                if self.similar:
+                    phash = self._compute_phash(image)
+                    if phash is not None and self._find_similar(phash):
+                        results.append(f"图库【{self.name}】中已有相似图片，已跳过。")
+                        continue
+
+            info = probe_image(image) or {}
+            if self._already_stored(digest, info.get("format")):
+                results.append(f"图片已存在于图库【{self.name}】，已跳过。")
+                continue
+
+            # 只为确实要写入的图片腾出空位，重复图片不会触发淘汰
+            if not self._make_room():
+                results.append(f"图库【{self.name}】已满，请清理后再添加！")
+                continue
+
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+
+            image_path = self._write_image(image, digest, info.get("format"), label)
+            if image_path is None:
+                results.append(f"图片已存在于图库【{self.name}】，已跳过。")
+                continue
+            if self._hash_index.loaded:
+                self._hash_index.add(image_path, digest, phash, save=False)
+                index_dirty = True
+            if self._bk_tree is not None and phash is not None:
+                self._bk_tree.add(phash, os.path.basename(image_path))
+            rows.append({
+                "path": image_path,
+                "gallery": self.name,
+                "label": label,
+                "size": len(image),
+                "width": info.get("width", 0),
+                "height": info.get("height", 0),
+                "content_hash": digest,
+                "phash": phash,
+                "added_by": added_by,
+            })
+            results.append(f"已添加图片到图库【{self.name}】。")
+
+        # 淘汰只在内存中移除索引条目，与新增条目一起写盘
+        if index_dirty or self.evicted_count != evicted_before:
+            self._hash_index.save()
+        if rows and self._catalog:
+            self._catalog.add_images(rows)
+        return results
+
+    def _write_image(self, image: bytes, digest: str, fmt: Optional[str], label: str) -> Optional[str]:
+        """
+        按图库布局写入图片并登记到图片列表
+        Returns:
+            str | None: 图片路径；分片布局下内容已存在时返回 None
+        """
+        if self._images is None:
+            self._load_images()
+        if self.layout == "sharded":
+            image_path = self._store_blob(image, digest, fmt)
+            if image_path in self._image_pos:
+                return None
+        else:
+            image_path = self._next_flat_path(label)
+            _atomic_write(image_path, image)
+        self._append_image(image_path)
+        self._mark_changed(image_path)
+        if self._eviction_heap is not None:
+            self._eviction_heap.add(image_path)
+        return image_path
+
+    async def import_archive(
+        self,
+        zip_file: str,
+        transform: Optional[Callable[[bytes], bytes]] = None,
+        label: str = "",
+        added_by: str = "",
+        progress: Optional[ProgressCallback] = None,
+    ) -> str:
+        """
+        从压缩包批量导入图片：条目在线程池中校验与压缩，按内容去重，索引与目录在结束时一次写入
+        Args:
+            zip_file: 压缩包路径
+            transform: 图片变换(如压缩)，在工作线程中执行
+            label: 图片标签，留空时从条目文件名(标签_序号)中解析
+            added_by: 添加者
+            progress: 进度回调
         """
-        if self.is_full():
-            return f"图库【{self.name}】已满，请清理后再添加！"
+        busy = self._busy_message()
+        if busy:
+            return busy
+        async with self._exclusive("导入"):
+            return await self._import_archive(zip_file, transform, label, added_by, progress)
 
-        if self.duplicate and self.is_duplicate(image):
-            return f"图片已存在于图库【{self.name}】，已跳过。"
+    async def _import_archive(
+        self,
+        zip_file: str,
+        transform: Optional[Callable[[bytes], bytes]],
+        label: str,
+        added_by: str,
+        progress: Optional[ProgressCallback],
+    ) -> str:
+        try:
+            names = await asyncio.to_thread(list_archive_images, zip_file)
+        except (OSError, zipfile.BadZipFile) as e:
+            return f"无法读取压缩包：{e}"
+        if not names:
+            return "压缩包中没有可导入的图片。"
 
         if not os.path.exists(self.path):
             os.makedirs(self.path)
+        await self._load_hash_index()
+        await self._prepare_eviction()
+        check_similar = self.duplicate and self.similar
+        added, duplicated, invalid, full = 0, 0, 0, 0
+        evicted: Set[str] = set()
+        evicted_before = self.evicted_count
+        rows = []
+        total = len(names)
+        step = max(1, total // 10)
+        done = 0
+        async for name, prepared in iter_archive_images(zip_file, names, transform, check_similar):
+            done += 1
+            if progress and (done % step == 0 or done == total):
+                await progress("导入", done, total)
+            if prepared is None:
+                invalid += 1
+                continue
+            if self.duplicate and (
+                self._hash_index.contains(prepared.digest)
+                or (check_similar and prepared.phash is not None and self._find_similar(prepared.phash))
+            ):
+                duplicated += 1
+                continue
+            if self._already_stored(prepared.digest, prepared.info.get("format")):
+                duplicated += 1
+                continue
+            # 去重之后才淘汰，重复条目既不占容量也不会挤掉旧图
+            if not self._make_room(evicted):
+                full += 1
+                continue
+            image_label = label or label_from_name(os.path.basename(name))
+            try:
+                image_path = self._write_image(prepared.data, prepared.digest, prepared.info.get("format"), image_label)
+            except OSError as e:
+                logger.error(f"导入图片失败【{name}】: {e}")
+                invalid += 1
+                continue
+            if image_path is None:
+                duplicated += 1
+                continue
+            # 平铺布局会复用被淘汰图片的文件名
+            evicted.discard(image_path)
+            self._hash_index.add(image_path, prepared.digest, prepared.phash, save=False)
+            if self._bk_tree is not None and prepared.phash is not None:
+                self._bk_tree.add(prepared.phash, os.path.basename(image_path))
+            rows.append({
+                "path": image_path,
+                "gallery": self.name,
+                "label": image_label,
+                "size": len(prepared.data),
+                "width": prepared.info.get("width", 0),
+                "height": prepared.info.get("height", 0),
+                "content_hash": prepared.digest,
+                "phash": prepared.phash,
+                "added_by": added_by,
+            })
+            added += 1
+
+        evicted_count = self.evicted_count - evicted_before
+        if added or evicted_count:
+            self._hash_index.save()
+            if self._catalog and rows:
+                self._catalog.add_images([row for row in rows if row["path"] not in evicted])
+            self.save_manifest()
+        msg = f"图库【{self.name}】导入完成：新增 {added} 张"
+        if duplicated:
+            msg += f"，重复跳过 {duplicated} 张"
+        if invalid:
+            msg += f"，无效 {invalid} 个"
+        if evicted_count:
+            msg += f"，淘汰旧图 {evicted_count} 张"
+        if full:
+            msg += f"，图库已满未导入 {full} 张"
+        return msg + "。"
+
+    def _busy_message(self) -> Optional[str]:
+        """
+        图库正在进行耗时的写操作时返回提示，耗时操作之间不排队等待
+        """
+        if self._busy:
+            return f"图库【{self.name}】正在{self._busy}中，请稍后再试。"
+        return None
 
-        image_name = f"{label}_{len(self.images) + 1}.jpg"
-        image_path = os.path.join(self.path, image_name)
-        with open(image_path, "wb") as f:
-            f.write(image)
-        self.images.append(image_path)
-        return f"已添加图片到图库【{self.name}】。"
+    @asynccontextmanager
+    async def _exclusive(self, action: str):
+        """
+        持有写锁执行耗时操作，期间其他写入等待其完成
+        """
+        async with self._write_lock:
+            self._busy = action
+            try:
+                yield
+            finally:
+                self._busy = None
+
+    def archive_entries(self) -> List[Tuple[str, str]]:
+        """
+        导出压缩包的 (文件路径, 压缩包内路径)
+        分片布局的文件名不含标签，导出为 标签_哈希.扩展名，导入时按 标签_序号 的规则还原标签
+        """
+        if self.layout != "sharded":
+            return [(p, os.path.relpath(p, self.path)) for p in self.images]
+        labels = self._catalog.labels(self.name) if self._catalog else {}
+        entries = []
+        for image_path in self.images:
+            name = os.path.basename(image_path)
+            label = labels.get(image_path)
+            entries.append((image_path, f"{label}_{name}" if label else name))
+        return entries
 
-    def del_image(self, image_name: str) -> str:
+    def _already_stored(self, digest: str, fmt: Optional[str]) -> bool:
+        """
+        分片布局下相同内容的文件已存在于本图库
+        """
+        return self.layout == "sharded" and os.path.exists(self._blob_path(digest, fmt))
+
+    def _next_flat_path(self, label: str) -> str:
+        """
+        平铺布局下的新文件路径，跳过已存在的序号，避免删除图片后覆盖已有文件
+        """
+        index = len(self.images) + 1
+        while True:
+            image_path = os.path.join(self.path, f"{label}_{index}.jpg")
+            if not os.path.exists(image_path):
+                return image_path
+            index += 1
+
+    def _blob_path(self, digest: str, fmt: Optional[str] = None) -> str:
+        ext = SHARDED_EXTENSIONS.get(fmt or "", ".jpg")
+        return os.path.join(self.path, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def _store_blob(self, image: bytes, digest: str, fmt: Optional[str] = None) -> str:
+        """
+        按内容哈希存放图片；其他图库已有相同内容时以硬链接共享同一份数据
+        """
+        blob_path = self._blob_path(digest, fmt)
+        if os.path.exists(blob_path):
+            return blob_path
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(blob_path), f".{digest}.tmp")
+        linked = False
+        if self._catalog:
+            for source in self._catalog.paths_by_hash(digest):
+                try:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    os.link(source, tmp_path)
+                    linked = True
+                    break
+                except OSError:
+                    continue
+        if linked:
+            os.replace(tmp_path, blob_path)
+        else:
+            _atomic_write(blob_path, image)
+        return blob_path
+
+    def _resolve_image_name(self, image_name: str) -> Optional[str]:
+        """
+        将图片名解析为路径；sharded 布局下支持文件名或至少 8 位的哈希前缀
+        """
+        if self.layout != "sharded":
+            return os.path.join(self.path, image_name)
+        prefix = os.path.splitext(image_name)[0]
+        if len(prefix) < 8:
+            return None
+        matches = [p for p in self.images if os.path.basename(p).startswith(prefix)]
+        return matches[0] if len(matches) == 1 else None
+
+    async def del_image(self, image_name: str) -> str:
         """
         删除图片
         """
-        image_path = os.path.join(self.path, image_name)
-        if os.path.exists(image_path):
+        async with self._write_lock:
+            return self._del_image(image_name)
+
+    def _del_image(self, image_name: str) -> str:
+        image_path = self._resolve_image_name(image_name)
+        if image_path and os.path.exists(image_path):
             os.remove(image_path)
-            self.images.remove(image_path)
+            self._forget_image(image_path)
             return f"已删除图片【{image_name}】。"
         return f"未找到图片【{image_name}】。"
 
+    def _forget_image(self, image_path: str, save_index: bool = True):
+        """
+        文件删除后，从图片列表、感知哈希树、哈希索引、淘汰队列与图片目录中移除
+        """
+        if self._images is not None and self._discard_image(image_path):
+            self._mark_changed(image_path)
+        self._forget_phash(image_path)
+        self._hash_index.remove(image_path, save=save_index)
+        if self._eviction_heap is not None:
+            self._eviction_heap.remove(image_path)
+        if self._catalog:
+            self._catalog.remove_image(image_path)
+
+    def _make_room(self, evicted: Optional[Set[str]] = None) -> bool:
+        """
+        图库已满时按淘汰策略移除图片，直到有空位
+        以内存中的图片列表为准：批量写入期间图片目录要到最后才登记，计数会滞后
+        Args:
+            evicted: 收集被淘汰的图片路径
+
+        Returns:
+            bool: 是否已有空位；未启用淘汰时返回 False
+        """
+        while len(self.images) >= self.capacity:
+            victim = self._evict_one()
+            if not victim:
+                return False
+            if evicted is not None:
+                evicted.add(victim)
+        return True
+
+    def _evict_one(self) -> Optional[str]:
+        """
+        按淘汰策略移除一张图片，并记录到图库信息中
+        Returns:
+            str | None: 被淘汰的图片路径，未启用淘汰或没有可淘汰的图片时为 None
+        """
+        if self.eviction == "none":
+            return None
+        if self._eviction_heap is None:
+            self._eviction_heap = self._build_eviction_heap()
+        victim = self._eviction_heap.pop()
+        if victim is None:
+            return None
+        try:
+            os.remove(victim)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"淘汰图片失败【{victim}】: {e}")
+            return None
+        # 哈希索引由调用方在整批处理结束后一次写入
+        self._forget_image(victim, save_index=False)
+        self.evicted_count += 1
+        self.recent_evictions.append({
+            "name": os.path.relpath(victim, self.path),
+            "policy": self.eviction,
+            "time": int(time.time()),
+        })
+        del self.recent_evictions[:-EVICTION_LOG_SIZE]
+        logger.info(f"图库【{self.name}】已满，按 {self.eviction} 策略淘汰图片: {victim}")
+        return victim
+
+    async def _load_hash_index(self):
+        # 索引缺失或过期时需要逐个哈希图片文件，放到线程中重建，不阻塞事件循环
+        if not self._hash_index.loaded:
+            await asyncio.to_thread(self._hash_index.load, list(self.images))
+
+    async def _prepare_eviction(self):
+        # 淘汰顺序取自图片目录，首次需要淘汰前先完成对齐
+        if self.eviction != "none" and self._eviction_heap is None:
+            await self.sync_catalog()
+
+    def _build_eviction_heap(self) -> EvictionHeap:
+        heap = EvictionHeap(self.eviction)
+        if self._catalog and self._catalog_synced:
+            heap.load(self._catalog.serve_stats(self.name))
+            return heap
+        rows = []
+        for image_path in self.images:
+            try:
+                rows.append((image_path, os.path.getmtime(image_path), 0, None))
+            except OSError:
+                continue
+        heap.load(rows)
+        return heap
+
+    def record_serve(self, image_path: str):
+        """
+        记录图片被发送一次，更新淘汰队列
+        """
+        if self._eviction_heap is not None:
+            self._eviction_heap.touch(image_path)
+
+    def set_eviction(self, policy: str) -> str:
+        """
+        设置图库满时的淘汰策略
+        """
+        self.eviction = policy
+        self._eviction_heap = None
+        if policy == "none":
+            return f"图库【{self.name}】已关闭淘汰，满后将拒绝添加图片。"
+        return f"图库【{self.name}】满后将按 {policy} 策略淘汰旧图。"
+
     def is_full(self) -> bool:
         """
-        判断图库是否已满
+        判断图库是否已满，与淘汰时的判断一致，以内存中的图片列表为准
         """
         return len(self.images) >= self.capacity
 
@@ -75,43 +780,155 @@ class Gallery:
         """
         判断图片是否重复
         """
-        # 简单的哈希检查，实际应用中可能需要更复杂的图像相似度算法
-        image_hash = hash(image)
-        for img_path in self.images:
-            with open(img_path, "rb") as f:
-                if hash(f.read()) == image_hash:
-                    return True
+        self._hash_index.ensure_loaded(self.images)
+        if self._hash_index.contains(hash_bytes(image)):
+            return True
+        if self.similar:
+            phash = self._compute_phash(image)
+            return phash is not None and bool(self._find_similar(phash))
         return False
 
+    def _compute_phash(self, image: bytes) -> Optional[int]:
+        try:
+            return dhash(image)
+        except Exception as e:
+            logger.warning(f"计算感知哈希失败: {e}")
+            return None
+
+    def _build_bk_tree(self) -> BKTree:
+        """
+        构建感知哈希 BK 树，缺失的感知哈希会补算并写回索引
+        """
+        self._hash_index.ensure_loaded(self.images)
+        tree = BKTree()
+        dirty = False
+        for image_path in self.images:
+            phash = self._hash_index.get_phash(image_path)
+            if phash is None:
+                try:
+                    with open(image_path, "rb") as f:
+                        phash = dhash(f.read())
+                except Exception as e:
+                    logger.warning(f"计算感知哈希失败【{image_path}】: {e}")
+                    continue
+                self._hash_index.set_phash(image_path, phash)
+                dirty = True
+            tree.add(phash, os.path.basename(image_path))
+        if dirty:
+            self._hash_index.save()
+        return tree
+
+    def _find_similar(self, phash: int) -> List[str]:
+        """
+        查找汉明距离在阈值内的相似图片
+        """
+        if self._bk_tree is None:
+            self._bk_tree = self._build_bk_tree()
+        return [name for _, name in self._bk_tree.search(phash, self.similar_threshold)]
+
+    def _forget_phash(self, image_path: str):
+        if self._bk_tree is None:
+            return
+        phash = self._hash_index.get_phash(image_path)
+        if phash is not None:
+            self._bk_tree.remove(phash, os.path.basename(image_path))
+
+    def bind_keyword_index(self, keyword_index: Optional[ScopedKeywordIndex]):
+        """
+        绑定图库管理器的关键词索引，关键词增删时同步更新
+        """
+        self._keyword_index = keyword_index
+
+    def bind_catalog(self, catalog: Optional[ImageCatalog]):
+        """
+        绑定图库管理器共享的图片目录
+        """
+        self._catalog = catalog
+        self._catalog_synced = False
+
+    async def sync_catalog(self):
+        """
+        将图片目录与文件系统对齐，每个图库只在首次需要时对齐一次；
+        读取图片信息与文件状态在线程中进行，不阻塞事件循环
+        """
+        if not self._catalog or self._catalog_synced:
+            return
+        known = set(self._catalog.paths(self.name))
+        missing = [p for p in self.images if p not in known]
+        prepared = {}
+        if missing:
+            rows = await asyncio.to_thread(self._catalog_rows, missing)
+            prepared = {row["path"]: row for row in rows}
+
+        def rows_for(paths: List[str]) -> List[dict]:
+            # 等待线程期间新写入的图片已自行登记，这里只为极少数仍缺失的路径补生成
+            rest = [p for p in paths if p not in prepared]
+            return [prepared[p] for p in paths if p in prepared] + self._catalog_rows(rest)
+
+        self._catalog.reconcile(self.name, self.images, rows_for)
+        self._catalog_synced = True
+
+    def _catalog_rows(self, image_paths: List[str]) -> List[dict]:
+        entries = self._hash_index.snapshot()
+        rows = []
+        for image_path in image_paths:
+            name = os.path.basename(image_path)
+            try:
+                info = probe_cache.get(image_path) or {}
+                stat = os.stat(image_path)
+            except OSError:
+                continue
+            entry = entries.get(name) or {}
+            rows.append({
+                "path": image_path,
+                "gallery": self.name,
+                "label": label_from_name(name),
+                "size": info.get("size") or stat.st_size,
+                "width": info.get("width", 0),
+                "height": info.get("height", 0),
+                "content_hash": entry.get("hash"),
+                "phash": entry.get("phash"),
+                # 补登记的图片以文件修改时间作为添加时间，使 fifo 淘汰顺序与实际一致
+                "added_at": stat.st_mtime,
+            })
+        return rows
+
     def add_keyword(self, keyword: str, is_fuzzy: bool = False) -> str:
         """
         添加匹配关键词
         """
-        if is_fuzzy:
-            if keyword not in self.fuzzy_keywords:
-                self.fuzzy_keywords.append(keyword)
-                return f"已添加模糊匹配词【{keyword}】到图库【{self.name}】。"
-            return f"模糊匹配词【{keyword}】已存在。"
-        else:
-            if keyword not in self.exact_keywords:
-                self.exact_keywords.append(keyword)
-                return f"已添加精准匹配词【{keyword}】到图库【{self.name}】。"
-            return f"精准匹配词【{keyword}】已存在。"
+        keywords = self.fuzzy_keywords if is_fuzzy else self.exact_keywords
+        if keyword in keywords:
+            return f"{'模糊' if is_fuzzy else '精准'}匹配词【{keyword}】已存在。"
+        keywords.append(keyword)
+        if self._keyword_index:
+            self._keyword_index.add(keyword, self.name, is_fuzzy, self.groups)
+        return f"已添加{'模糊' if is_fuzzy else '精准'}匹配词【{keyword}】到图库【{self.name}】。"
 
     def del_keyword(self, keyword: str, is_fuzzy: bool = False) -> str:
         """
         删除匹配关键词
         """
-        if is_fuzzy:
-            if keyword in self.fuzzy_keywords:
-                self.fuzzy_keywords.remove(keyword)
-                return f"已删除模糊匹配词【{keyword}】。"
-            return f"模糊匹配词【{keyword}】不存在。"
-        else:
-            if keyword in self.exact_keywords:
-                self.exact_keywords.remove(keyword)
-                return f"已删除精准匹配词【{keyword}】。"
-            return f"精准匹配词【{keyword}】不存在。"
+        keywords = self.fuzzy_keywords if is_fuzzy else self.exact_keywords
+        if keyword not in keywords:
+            return f"{'模糊' if is_fuzzy else '精准'}匹配词【{keyword}】不存在。"
+        keywords.remove(keyword)
+        if self._keyword_index:
+            self._keyword_index.remove(keyword, self.name, is_fuzzy, self.groups)
+        return f"已删除{'模糊' if is_fuzzy else '精准'}匹配词【{keyword}】。"
+
+    def set_groups(self, groups: List[str]) -> str:
+        """
+        设置图库绑定的群，关键词随之移动到对应群的作用域
+        """
+        groups = list(dict.fromkeys(g for g in groups if g))
+        if self._keyword_index:
+            self._keyword_index.remove_gallery(self.name, self.exact_keywords, self.fuzzy_keywords, self.groups)
+            self._keyword_index.add_gallery(self.name, self.exact_keywords, self.fuzzy_keywords, groups)
+        self.groups = groups
+        if groups:
+            return f"图库【{self.name}】的匹配词现仅在群 {', '.join(groups)} 中生效。"
+        return f"图库【{self.name}】的匹配词现对所有群生效。"
 
     def set_fuzzy(self, fuzzy: bool) -> str:
         """
@@ -120,6 +937,15 @@ class Gallery:
         self.fuzzy = fuzzy
         return f"图库【{self.name}】已切换到{'模糊' if fuzzy else '精准'}匹配模式。"
 
+    def set_similar(self, similar: bool, threshold: Optional[int] = None) -> str:
+        """
+        设置是否按感知哈希去除相似图片
+        """
+        self.similar = similar
+        if threshold is not None:
+            self.similar_threshold = threshold
+        return f"图库【{self.name}】相似图片去重功能已{'开启' if similar else '关闭'}（阈值{self.similar_threshold}）。"
+
     def set_capacity(self, capacity: int) -> str:
         """
         设置图库容量
@@ -141,36 +967,179 @@ class Gallery:
         self.duplicate = duplicate
         return f"图库【{self.name}】图片去重功能已{'开启' if duplicate else '关闭'}。"
 
-    def remove_duplicates(self) -> str:
+    async def remove_duplicates(self, progress: Optional[ProgressCallback] = None) -> str:
         """
         移除图库中的重复图片
         """
-        unique_hashes = set()
-        images_to_keep = []
+        busy = self._busy_message()
+        if busy:
+            return busy
+        async with self._exclusive("去重"):
+            return await self._remove_duplicates(progress)
+
+    async def _remove_duplicates(self, progress: Optional[ProgressCallback]) -> str:
+        duplicate_groups, updated = await scan_duplicates(
+            list(self.images),
+            self._hash_index.snapshot(),
+            similar=self.similar,
+            progress=progress,
+        )
+        self._hash_index.merge(updated)
+
+        self._bk_tree = None
         duplicates_removed_count = 0
+        for group in duplicate_groups:
+            # Sorted to ensure consistent removal order if multiple duplicates
+            for image_path in group[1:]:
+                if self._remove_duplicate_file(image_path):
+                    duplicates_removed_count += 1
+
+        if self.similar:
+            # 按顺序保留每组相似图片中的第一张
+            entries = self._hash_index.snapshot()
+            kept = BKTree()
+            for image_path in sorted(self.images):
+                entry = entries.get(os.path.basename(image_path))
+                phash = entry.get("phash") if entry else None
+                if phash is None:
+                    continue
+                if kept.search(phash, self.similar_threshold):
+                    if self._remove_duplicate_file(image_path):
+                        duplicates_removed_count += 1
+                else:
+                    kept.add(phash, os.path.basename(image_path))
+            if self._hash_index.loaded:
+                self._bk_tree = kept
+
+        if duplicates_removed_count > 0:
+            self._hash_index.save()
+            return f"图库【{self.name}】已移除 {duplicates_removed_count} 张重复图片。"
+        return f"图库【{self.name}】中没有发现重复图片。"
+
+    async def migrate_to_sharded(self) -> str:
+        """
+        将平铺布局的图库迁移为按内容哈希分片的布局，标签保留在图片目录中
+        """
+        if self.layout == "sharded":
+            return f"图库【{self.name}】已是分片布局。"
+        busy = self._busy_message()
+        if busy:
+            return busy
+        async with self._exclusive("迁移"):
+            return await self._migrate_to_sharded()
+
+    async def _migrate_to_sharded(self) -> str:
+        # 先对齐目录，保证每张图片的标签都已登记，迁移后文件名不再携带标签
+        await self.sync_catalog()
+        images = list(self.images)
+        moves, entries, failed = await asyncio.to_thread(
+            self._move_to_shards, images, self._hash_index.snapshot()
+        )
+
+        if self._catalog:
+            self._catalog.move_images(moves)
+        moved = {old for old, _ in moves}
+        new_images = [p for p in images if p not in moved]
+        for _, new in moves:
+            if new not in new_images:
+                new_images.append(new)
+        self._set_images(new_images)
+        self._mark_changed()
+        self._hash_index.replace(entries)
+        self._bk_tree = None
+        self._eviction_heap = None
+        self.layout = "sharded"
+        self._dir_snapshot, _ = await asyncio.to_thread(self._scan_changes, {})
+        self.save_manifest()
+        msg = f"图库【{self.name}】已迁移为分片布局，共迁移 {len(moves)} 张图片。"
+        if failed:
+            msg += f"\n{failed} 张图片迁移失败，已保留在原位置。"
+        return msg
 
-        for image_path in sorted(self.images): # Sort to ensure consistent removal order if multiple duplicates
+    def _move_to_shards(self, images: List[str], entries: Dict[str, dict]) -> Tuple[List[Tuple[str, str]], Dict[str, dict], int]:
+        """
+        在线程中逐个重命名文件；内容相同的图片只保留一份
+        Returns:
+            (路径变更列表, 新的哈希索引条目, 失败数)
+        """
+        moves = []
+        new_entries = {}
+        failed = 0
+        for image_path in images:
+            name = os.path.basename(image_path)
             try:
+                stat = os.stat(image_path)
+                entry = entries.get(name)
+                if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns:
+                    digest = entry["hash"]
+                else:
+                    entry = {}
+                    digest = hash_file(image_path)
                 with open(image_path, "rb") as f:
-                    image_bytes = f.read()
-                    image_hash = hash(image_bytes)
-                
-                if image_hash in unique_hashes:
+                    head = f.read(PROBE_HEAD_SIZE)
+                info = probe_image(head, complete=stat.st_size <= PROBE_HEAD_SIZE) or {}
+                blob_path = self._blob_path(digest, info.get("format"))
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                if os.path.exists(blob_path):
                     os.remove(image_path)
-                    duplicates_removed_count += 1
-                    logger.info(f"Removed duplicate image: {image_path} from gallery {self.name}")
                 else:
-                    unique_hashes.add(image_hash)
-                    images_to_keep.append(image_path)
-            except Exception as e:
-                logger.error(f"Error processing image {image_path} for duplicate removal: {e}")
+                    os.replace(image_path, blob_path)
+                blob_stat = os.stat(blob_path)
+            except OSError as e:
+                logger.error(f"迁移图片失败【{image_path}】: {e}")
+                failed += 1
+                continue
+            moves.append((image_path, blob_path))
+            new_entry = {"size": blob_stat.st_size, "mtime": blob_stat.st_mtime_ns, "hash": digest}
+            if entry.get("phash") is not None:
+                new_entry["phash"] = entry["phash"]
+            new_entries[os.path.basename(blob_path)] = new_entry
+        return moves, new_entries, failed
 
-        self.images = images_to_keep
-        
-        if duplicates_removed_count > 0:
-            return f"图库【{self.name}】已移除 {duplicates_removed_count} 张重复图片。"
-        else:
-            return f"图库【{self.name}】中没有发现重复图片。"
+    async def move_to(self, new_path: str) -> str:
+        """
+        将整个图库目录移动到新位置，并更新图片目录中的路径与内存中的索引
+        同一文件系统内为原子重命名，跨设备时先硬链接或复制到临时目录再改名
+        """
+        busy = self._busy_message()
+        if busy:
+            return busy
+        if os.path.exists(new_path):
+            return f"目标目录【{new_path}】已存在！"
+        async with self._exclusive("移动"):
+            return await self._move_to(new_path)
+
+    async def _move_to(self, new_path: str) -> str:
+        old_path = self.path
+        try:
+            method = await asyncio.to_thread(move_tree, old_path, new_path)
+        except OSError as e:
+            logger.error(f"移动图库【{self.name}】失败: {e}")
+            return f"移动图库【{self.name}】失败！"
+
+        if self._catalog:
+            self._catalog.relocate(self.name, old_path, new_path)
+        self.path = new_path
+        if self._images is not None:
+            self._set_images([os.path.join(new_path, os.path.relpath(p, old_path)) for p in self._images])
+        # 以下结构均以绝对路径为键，直接重建
+        self._hash_index = HashIndex(new_path, self._hash_index_file)
+        self._bk_tree = None
+        self._eviction_heap = None
+        self._mark_changed()
+        self.save_manifest()
+        logger.info(f"图库【{self.name}】已从【{old_path}】移动到【{new_path}】({method})")
+        return f"图库【{self.name}】已移动到【{new_path}】。"
+
+    def _remove_duplicate_file(self, image_path: str) -> bool:
+        try:
+            os.remove(image_path)
+            self._forget_image(image_path, save_index=False)
+            logger.info(f"Removed duplicate image: {image_path} from gallery {self.name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error processing image {image_path} for duplicate removal: {e}")
+            return False
 
     def need_compress(self, image_bytes: bytes) -> bool:
         """
@@ -179,7 +1148,7 @@ class Gallery:
         if not self.compress:
             return False
         
-        # This logic is handled in auto_collect_image or wherever image is added
+        # This logic is handled in the auto-collect stage or wherever image is added
         # For now, just return self.compress status
         return self.compress
 
@@ -187,9 +1156,8 @@ class Gallery:
         """
         获取图库信息
         """
-        info = self.__dict__.copy()
-        info.pop("images")
+        info = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
         return info
 
     def __str__(self) -> str:
-        return f"图库名: {self.name}, 路径: {self.path}, 图片数量: {len(self.images)}" 
\ No newline at end of file
+        return f"图库名: {self.name}, 路径: {self.path}, 图片数量: {self.count()}" 
\ No newline at end of file
@@ -1,50 +1,186 @@
 import asyncio
 import os
 import json
-from typing import Dict, List, Optional
+import shutil
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from data.plugins.qgcj.core.gallery import Gallery
+from data.plugins.qgcj.core.keyword_scope import ScopedKeywordIndex
+from data.plugins.qgcj.core.match_cache import NO_CANDIDATES, MatchCache, MatchCandidates
+from data.plugins.qgcj.core.prefilter import KeywordPrefilter
+from data.plugins.qgcj.core.catalog import ImageCatalog
+from data.plugins.qgcj.core.export import GalleryExporter
+from data.plugins.qgcj.core.placement import GalleryPlacer
 from astrbot import logger
 
 
+# 图库信息变更后延迟写盘的时间(秒)，期间的多次变更合并为一次写入
+SAVE_DELAY = 2.0
+
+
 class GalleryManager:
     """
     图库管理器
     """
 
     def __init__(
-        self, galleries_dirs: List[str], gallery_info_file: str, default_gallery_info: dict
+        self,
+        galleries_dirs: List[str],
+        gallery_info_file: str,
+        default_gallery_info: dict,
+        rescan_interval: float = 0,
+        placement: str = "most_free",
     ):
         self.galleries_dirs = galleries_dirs
+        # 新图库在多个总目录之间的放置策略
+        self.placer = GalleryPlacer(galleries_dirs, placement)
         self.gallery_info_file = gallery_info_file
         self.default_gallery_info = default_gallery_info
         self.galleries: Dict[str, Gallery] = {}
-        self.exact_keywords: List[str] = []
-        self.fuzzy_keywords: List[str] = []
+        # 按群划分作用域的关键词索引；keyword_index 为汇总所有作用域的索引，预过滤基于它进行
+        self.keywords = ScopedKeywordIndex()
+        self.keyword_index = self.keywords.all
+        self.prefilter = KeywordPrefilter(self.keyword_index)
+        self.match_cache = MatchCache()
+        self.manifest_dir = os.path.join(os.path.dirname(gallery_info_file), "qgcj_manifests")
+        self.catalog = ImageCatalog(os.path.join(os.path.dirname(gallery_info_file), "qgcj_catalog.db"))
+        self.exporter = GalleryExporter(os.path.join(os.path.dirname(gallery_info_file), "qgcj_exports"))
+        # 后台增量扫描的间隔(秒)，0 表示只通过命令手动扫描
+        self.rescan_interval = rescan_interval
+        self._rescan_task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._dirty: Set[str] = set()
+        self._info_cache: Dict[str, str] = {}
+        self._save_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_ready(self) -> bool:
+        """
+        图库是否已初始化完成
+        """
+        return self._ready.is_set()
+
+    async def wait_ready(self, timeout: float = 10) -> bool:
+        """
+        等待图库初始化完成
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
     async def initialize(self):
         """
-        初始化图库管理器
+        初始化图库管理器，图片列表在首次访问图库时才加载
         """
-        if not os.path.exists(os.path.dirname(self.gallery_info_file)):
-            os.makedirs(os.path.dirname(self.gallery_info_file))
+        try:
+            if not os.path.exists(os.path.dirname(self.gallery_info_file)):
+                os.makedirs(os.path.dirname(self.gallery_info_file))
+
+            if os.path.exists(self.gallery_info_file):
+                with open(self.gallery_info_file, "r", encoding="utf-8") as f:
+                    galleries_info = json.load(f)
+            else:
+                galleries_info = []
 
-        if os.path.exists(self.gallery_info_file):
-            with open(self.gallery_info_file, "r", encoding="utf-8") as f:
-                galleries_info = json.load(f)
+            for gallery_info in galleries_info:
+                gallery = self._build_gallery(gallery_info)
+                if gallery:
+                    self._register_gallery(gallery)
+
+            # 如果没有图库，创建一个默认图库
+            if not self.galleries:
+                gallery = self._build_gallery(self.default_gallery_info)
+                if gallery:
+                    self._register_gallery(gallery)
+
+            self._save_galleries_info()
+            logger.info(f"图库管理器初始化完成！共 {len(self.galleries)} 个图库")
+        finally:
+            self._ready.set()
+        if self.rescan_interval > 0:
+            self._rescan_task = asyncio.create_task(self._rescan_loop())
+
+    async def rescan(self, name: Optional[str] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        增量重新扫描图库目录，未指定图库时扫描所有已加载的图库
+        Returns:
+            图库名 -> (新增数, 移除数)
+        """
+        if name is not None:
+            galleries = [self.galleries[name]] if name in self.galleries else []
         else:
-            galleries_info = []
+            galleries = [g for g in self.galleries.values() if g.is_loaded]
+        results = {}
+        for gallery in galleries:
+            try:
+                results[gallery.name] = await gallery.rescan()
+            except Exception as e:
+                logger.error(f"图库【{gallery.name}】重新扫描失败: {e}")
+        return results
 
-        for gallery_info in galleries_info:
-            gallery = await self.load_gallery(gallery_info)
-            if gallery:
-                self.galleries[gallery.name] = gallery
+    async def _rescan_loop(self):
+        while True:
+            await asyncio.sleep(self.rescan_interval)
+            await self.rescan()
 
-        # 如果没有图库，创建一个默认图库
-        if not self.galleries:
-            await self.load_gallery(self.default_gallery_info)
+    def record_serve(self, gallery: Gallery, image_path: str):
+        """
+        记录图库的图片被发送一次
+        """
+        try:
+            self.catalog.record_serve(image_path)
+        except Exception as e:
+            logger.warning(f"记录图片发送次数失败: {e}")
+        gallery.record_serve(image_path)
 
-        self._update_keywords()
-        logger.info("图库管理器初始化完成！")
+    async def close(self):
+        """
+        写入未保存的信息并关闭图片目录
+        """
+        if self._rescan_task and not self._rescan_task.done():
+            self._rescan_task.cancel()
+        await self.flush()
+        self.catalog.close()
+
+    def _manifest_file(self, name: str) -> str:
+        return os.path.join(self.manifest_dir, f"{name}.json")
+
+    def _hash_index_file(self, name: str) -> str:
+        return os.path.join(self.manifest_dir, "hash_index", f"{name}.json")
+
+    def _build_gallery(self, gallery_info: dict) -> Optional[Gallery]:
+        """
+        根据图库信息创建图库对象，不扫描目录
+        """
+        try:
+            name = gallery_info["name"]
+            gallery = Gallery(gallery_info, self._manifest_file(name), self._hash_index_file(name))
+        except Exception as e:
+            logger.error(f"加载图库【{gallery_info.get('name')}】失败: {e}")
+            return None
+        gallery.bind_keyword_index(self.keywords)
+        gallery.bind_catalog(self.catalog)
+        return gallery
+
+    def _register_gallery(self, gallery: Gallery):
+        """
+        注册图库并登记其关键词，同名图库会被替换
+        """
+        self._unregister_gallery(gallery.name)
+        self.galleries[gallery.name] = gallery
+        self.keywords.add_gallery(gallery.name, gallery.exact_keywords, gallery.fuzzy_keywords, gallery.groups)
+        self.keywords.touch()
+
+    def _unregister_gallery(self, name: str):
+        """
+        注销图库并移除其关键词
+        """
+        gallery = self.galleries.pop(name, None)
+        if gallery:
+            self.keywords.remove_gallery(name, gallery.exact_keywords, gallery.fuzzy_keywords, gallery.groups)
+            self.keywords.touch()
+            gallery.bind_keyword_index(None)
 
     async def load_gallery(self, gallery_info: dict) -> Optional[Gallery]:
         """
@@ -55,16 +191,14 @@ class GalleryManager:
         if not os.path.exists(path):
             os.makedirs(path)
 
-        try:
-            gallery = Gallery(gallery_info)
-            self.galleries[name] = gallery
-            self._save_galleries_info()
-            self._update_keywords()
-            logger.info(f"图库【{name}】加载成功！")
-            return gallery
-        except Exception as e:
-            logger.error(f"加载图库【{name}】失败: {e}")
+        gallery = self._build_gallery(gallery_info)
+        if not gallery:
             return None
+        self._register_gallery(gallery)
+        await gallery.sync_catalog()
+        self.mark_dirty(name)
+        logger.info(f"图库【{name}】加载成功！")
+        return gallery
 
     async def delete_gallery(self, name: str) -> str:
         """
@@ -74,16 +208,57 @@ class GalleryManager:
             return f"图库【{name}】不存在！"
 
         gallery = self.galleries[name]
-        try:
-            shutil.rmtree(gallery.path)
-            del self.galleries[name]
-            self._save_galleries_info()
-            self._update_keywords()
-            logger.info(f"图库【{name}】删除成功！")
-            return f"图库【{name}】已删除。"
-        except Exception as e:
-            logger.error(f"删除图库【{name}】失败: {e}")
-            return f"删除图库【{name}】失败！"
+        busy = gallery._busy_message()
+        if busy:
+            return busy
+        # 持有图库写锁删除，不与进行中的写入、导入、移动等操作交错
+        async with gallery._exclusive("删除"):
+            try:
+                if os.path.exists(gallery.path):
+                    shutil.rmtree(gallery.path)
+                gallery.deleted = True
+                if os.path.exists(self._manifest_file(name)):
+                    os.remove(self._manifest_file(name))
+                if os.path.exists(self._hash_index_file(name)):
+                    os.remove(self._hash_index_file(name))
+                self._unregister_gallery(name)
+                self.catalog.remove_gallery(name)
+                self.exporter.forget(name)
+                self.mark_dirty()
+                logger.info(f"图库【{name}】删除成功！")
+                return f"图库【{name}】已删除。"
+            except Exception as e:
+                logger.error(f"删除图库【{name}】失败: {e}")
+                return f"删除图库【{name}】失败！"
+
+    def new_gallery_path(self, name: str) -> str:
+        """
+        按放置策略为新图库选择目录
+        """
+        return os.path.join(self.placer.choose(), name)
+
+    async def move_gallery(self, name: str, root: Optional[str] = None) -> str:
+        """
+        将图库移动到另一个总目录，未指定时按放置策略选择(不含当前目录)
+        """
+        gallery = self.galleries.get(name)
+        if gallery is None:
+            return f"图库【{name}】不存在！"
+        current = self.placer.root_of(gallery.path)
+        if root is None:
+            if len(self.galleries_dirs) < 2:
+                return "只配置了一个图库总目录，无需移动。"
+            root = self.placer.choose(exclude=current)
+        if root == current:
+            return f"图库【{name}】已在目录【{root}】中。"
+        with self.placer.busy(current), self.placer.busy(root):
+            msg = await gallery.move_to(os.path.join(root, os.path.basename(gallery.path)))
+        if gallery.path.startswith(os.path.join(root, "")):
+            self.exporter.forget(name)
+            self.mark_dirty(name)
+            # 立即写入图库信息，避免重启后仍指向旧目录
+            await self.flush()
+        return msg
 
     def get_gallery(self, name: str) -> Optional[Gallery]:
         """
@@ -97,22 +272,74 @@ class GalleryManager:
         """
         return list(self.galleries.values())
 
-    def _save_galleries_info(self):
+    def mark_dirty(self, name: Optional[str] = None):
         """
-        保存图库信息
+        标记图库信息已变更，延迟合并写盘
+        Args:
+            name: 变更的图库名，为空时仅触发写盘(如删除图库)
         """
-        with open(self.gallery_info_file, "w", encoding="utf-8") as f:
-            json.dump([g.get_info() for g in self.galleries.values()], f, ensure_ascii=False, indent=2)
+        if name:
+            self._dirty.add(name)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._save_galleries_info()
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._delayed_save())
 
-    def _update_keywords(self):
+    async def _delayed_save(self):
+        await asyncio.sleep(SAVE_DELAY)
+        self._save_task = None
+        self._save_galleries_info()
+
+    async def flush(self):
+        """
+        立即写入所有未保存的图库信息
+        """
+        if self._save_task and not self._save_task.done():
+            self._save_task.cancel()
+            self._save_task = None
+            self._save_galleries_info()
+        elif self._dirty:
+            self._save_galleries_info()
+
+    def _save_galleries_info(self):
         """
-        更新关键词列表
+        保存图库信息，仅重新序列化有变更的图库，并通过临时文件原子替换
         """
-        self.exact_keywords = []
-        self.fuzzy_keywords = []
+        for name in list(self._info_cache):
+            if name not in self.galleries:
+                del self._info_cache[name]
+        for name, gallery in self.galleries.items():
+            if name in self._dirty or name not in self._info_cache:
+                self._info_cache[name] = json.dumps(gallery.get_info(), ensure_ascii=False, indent=2)
+        self._dirty.clear()
+
+        content = "[\n" + ",\n".join(self._info_cache[name] for name in self.galleries) + "\n]"
+        tmp_file = f"{self.gallery_info_file}.tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_file, self.gallery_info_file)
+        except Exception as e:
+            logger.error(f"保存图库信息失败: {e}")
         for gallery in self.galleries.values():
-            self.exact_keywords.extend(gallery.exact_keywords)
-            self.fuzzy_keywords.extend(gallery.fuzzy_keywords)
+            gallery.save_manifest()
+
+    @property
+    def exact_keywords(self) -> List[str]:
+        """
+        所有精准匹配词
+        """
+        return list(self.keyword_index.exact)
+
+    @property
+    def fuzzy_keywords(self) -> List[str]:
+        """
+        所有模糊匹配词
+        """
+        return list(self.keyword_index.fuzzy)
 
     def get_gallery_by_attribute(self, **kwargs) -> List[Gallery]:
         """
@@ -129,15 +356,48 @@ class GalleryManager:
                 result.append(gallery)
         return result
 
-    def get_gallery_by_keyword(self, keyword: str) -> List[Gallery]:
+    def resolve_candidates(self, text: str, policy: str = "longest", group_id: Optional[str] = None) -> MatchCandidates:
         """
-        通过关键词获取图库
+        解析消息可能命中的候选图库，结果按关键词索引版本缓存
+        Args:
+            text: 消息文本
+            policy: 模糊匹配词的优先策略
+            group_id: 消息所在的群
         """
-        result = []
-        for gallery in self.galleries.values():
-            if keyword in gallery.exact_keywords or keyword in gallery.fuzzy_keywords:
-                result.append(gallery)
-        return result
+        # 没有独立作用域的群与私聊看到的都是全局作用域，共用同一条缓存
+        scope = group_id if group_id and group_id in self.keywords.scopes else None
+        key = (scope, policy, text)
+        version = self.keywords.version
+        candidates = self.match_cache.get(key, version)
+        if candidates is not None:
+            return candidates
+        exact = tuple(sorted(self.keywords.lookup(text, False, group_id)))
+        fuzzy = tuple(
+            (keyword, tuple(sorted(self.keywords.lookup(keyword, True, group_id))))
+            for keyword in self.keywords.search(text, policy, group_id)
+        )
+        candidates = MatchCandidates(exact, fuzzy) if exact or fuzzy else NO_CANDIDATES
+        # 模糊匹配自动机仍在后台重建时，结果基于旧关键词，不写入缓存
+        if self.keywords.matchers_current(group_id):
+            self.match_cache.put(key, version, candidates)
+        return candidates
+
+    def get_galleries(self, names: Iterable[str]) -> List[Gallery]:
+        """
+        按名称获取图库，忽略不存在的图库
+        """
+        return [self.galleries[name] for name in names if name in self.galleries]
+
+    async def set_groups(self, name: str, groups: List[str]) -> str:
+        """
+        设置图库绑定的群
+        """
+        gallery = self.get_gallery(name)
+        if not gallery:
+            return f"图库【{name}】不存在！"
+        res = gallery.set_groups(groups)
+        self.mark_dirty(name)
+        return res
 
     async def set_fuzzy(self, name: str, fuzzy: bool) -> str:
         """
@@ -147,5 +407,5 @@ class GalleryManager:
         if not gallery:
             return f"图库【{name}】不存在！"
         res = gallery.set_fuzzy(fuzzy)
-        self._save_galleries_info()
+        self.mark_dirty(name)
         return res 
\ No newline at end of file
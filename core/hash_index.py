@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Optional, Set
+from astrbot import logger
+
+HASH_INDEX_FILE = ".hash_index.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_bytes(data: bytes) -> str:
+    """
+    计算图片字节流的内容哈希
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    分块计算文件的内容哈希
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class HashIndex:
+    """
+    图库内容哈希索引，按文件大小与修改时间判断是否过期
+    索引文件存放在图库目录之外，写入索引不会改变图库目录的修改时间，也就不会触发重新扫描
+    """
+
+    def __init__(self, gallery_path: str, index_file: Optional[str] = None):
+        self.gallery_path = gallery_path
+        # 旧版本把索引写在图库目录下，首次保存到新位置后删除
+        self.legacy_file = os.path.join(gallery_path, HASH_INDEX_FILE)
+        self.index_file = index_file or self.legacy_file
+        # 文件名 -> {"size", "mtime", "hash"}
+        self.entries: Dict[str, dict] = {}
+        # 哈希 -> 文件名集合
+        self.hashes: Dict[str, Set[str]] = {}
+        self.loaded = False
+
+    def load(self, image_paths: Iterable[str]):
+        """
+        加载索引，并对新增、变更、已删除的文件进行增量修正
+        会逐个读取需要重新计算哈希的文件，异步代码中应放到线程中调用；
+        新索引建好后才整体替换，调用期间读取到的仍是旧内容
+        """
+        stored = self._read()
+        entries: Dict[str, dict] = {}
+        dirty = False
+        for image_path in image_paths:
+            name = os.path.basename(image_path)
+            try:
+                stat = os.stat(image_path)
+            except OSError:
+                dirty = True
+                continue
+            entry = stored.get(name)
+            if (
+                not entry
+                or entry.get("size") != stat.st_size
+                or entry.get("mtime") != stat.st_mtime_ns
+            ):
+                try:
+                    entry = {
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime_ns,
+                        "hash": hash_file(image_path),
+                    }
+                except OSError as e:
+                    logger.error(f"计算图片哈希失败【{image_path}】: {e}")
+                    continue
+                dirty = True
+            entries[name] = entry
+
+        if set(stored) != set(entries):
+            dirty = True
+        self.entries = {}
+        self.hashes = {}
+        for name, entry in entries.items():
+            self._put(name, entry)
+        self.loaded = True
+        if dirty:
+            self.save()
+
+    def ensure_loaded(self, image_paths: Iterable[str]):
+        """
+        首次使用时加载索引
+        """
+        if not self.loaded:
+            self.load(image_paths)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        获取当前索引条目的副本，未加载时直接读取索引文件
+        """
+        return dict(self.entries) if self.loaded else self._read()
+
+    def merge(self, entries: Dict[str, dict]):
+        """
+        合并外部计算好的索引条目(文件名 -> 条目)并持久化
+        """
+        if not entries:
+            return
+        if self.loaded:
+            for name, entry in entries.items():
+                self._drop(name)
+                self._put(name, entry)
+            self.save()
+        else:
+            stored = self._read()
+            stored.update(entries)
+            self._write(stored)
+
+    def replace(self, entries: Dict[str, dict]):
+        """
+        以给定条目整体替换索引并持久化，用于图库文件整体改名后
+        """
+        self.entries = {}
+        self.hashes = {}
+        for name, entry in entries.items():
+            self._put(name, entry)
+        self.loaded = True
+        self.save()
+
+    def contains(self, digest: str) -> bool:
+        """
+        判断哈希是否已存在
+        """
+        return bool(self.hashes.get(digest))
+
+    def get_phash(self, image_path: str) -> Optional[int]:
+        """
+        获取图片的感知哈希
+        """
+        entry = self.entries.get(os.path.basename(image_path))
+        return entry.get("phash") if entry else None
+
+    def set_phash(self, image_path: str, phash: int):
+        """
+        记录图片的感知哈希，需调用 save 持久化
+        """
+        entry = self.entries.get(os.path.basename(image_path))
+        if entry:
+            entry["phash"] = phash
+
+    def add(self, image_path: str, digest: str, phash: Optional[int] = None, save: bool = True):
+        """
+        登记新图片
+        """
+        stat = os.stat(image_path)
+        name = os.path.basename(image_path)
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+        if phash is not None:
+            entry["phash"] = phash
+        self._drop(name)
+        self._put(name, entry)
+        if save:
+            self.save()
+
+    def remove(self, image_path: str, save: bool = True):
+        """
+        移除图片记录
+        """
+        if self._drop(os.path.basename(image_path)) and save:
+            self.save()
+
+    def save(self):
+        """
+        原子地写入索引文件
+        """
+        if self.loaded:
+            self._write(self.entries)
+
+    def _read(self) -> Dict[str, dict]:
+        index_file = self.index_file
+        if not os.path.exists(index_file):
+            index_file = self.legacy_file
+            if not os.path.exists(index_file):
+                return {}
+        try:
+            with open(index_file, "r", encoding="utf-8") as f:
+                return json.load(f).get("entries", {})
+        except Exception as e:
+            logger.warning(f"哈希索引【{index_file}】损坏，将重建: {e}")
+            return {}
+
+    def _write(self, entries: Dict[str, dict]):
+        if not os.path.exists(self.gallery_path):
+            return
+        tmp_file = f"{self.index_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"algo": "sha256", "entries": entries}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.index_file)
+        except Exception as e:
+            logger.error(f"保存哈希索引【{self.index_file}】失败: {e}")
+            return
+        if self.index_file != self.legacy_file and os.path.exists(self.legacy_file):
+            try:
+                os.remove(self.legacy_file)
+            except OSError as e:
+                logger.warning(f"删除旧哈希索引【{self.legacy_file}】失败: {e}")
+
+    def _put(self, name: str, entry: dict):
+        self.entries[name] = entry
+        self.hashes.setdefault(entry["hash"], set()).add(name)
+
+    def _drop(self, name: str) -> bool:
+        entry = self.entries.pop(name, None)
+        if not entry:
+            return False
+        names = self.hashes.get(entry["hash"])
+        if names:
+            names.discard(name)
+            if not names:
+                del self.hashes[entry["hash"]]
+        return True
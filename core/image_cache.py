@@ -0,0 +1,81 @@
+import base64
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from astrbot import logger
+
+
+class ImageCache:
+    """
+    按字节预算限制的热门图片 LRU 缓存，缓存预编码的 base64 数据，
+    以 路径 + 修改时间 + 大小 为键，文件变更后自动失效
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # 路径 -> ((修改时间, 大小), base64 数据)
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], str]]" = OrderedDict()
+
+    def get_base64(self, path: str) -> Optional[str]:
+        """
+        获取图片的 base64 数据，未命中时从磁盘读取并缓存
+        Args:
+            path: 图片路径
+
+        Returns:
+            str | None: base64 数据，缓存关闭或读取失败时返回 None
+        """
+        if self.max_bytes <= 0:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._evict(path)
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(path)
+        if entry and entry[0] == key:
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        try:
+            with open(path, "rb") as f:
+                data = base64.b64encode(f.read()).decode()
+        except OSError as e:
+            logger.warning(f"读取图片失败【{path}】: {e}")
+            return None
+
+        self._evict(path)
+        # 单张图片超过预算的 1/4 时不缓存，避免一张大图挤掉所有热门图片
+        if len(data) <= self.max_bytes // 4:
+            self._entries[path] = (key, data)
+            self.current_bytes += len(data)
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+        return data
+
+    def _evict(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry:
+            self.current_bytes -= len(entry[1])
+
+    def stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from astrbot import logger
+from data.plugins.qgcj.core.hash_index import hash_bytes
+from data.plugins.qgcj.core.phash import dhash
+from data.plugins.qgcj.core.probe import probe_image
+
+IMPORT_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+# 单个条目的大小上限，超过的条目直接跳过
+IMPORT_MAX_ENTRY_SIZE = 20 * 1024 * 1024
+IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+# 同时在处理中的条目数，限制内存中缓存的图片数量
+IMPORT_WINDOW = IMPORT_WORKERS * 4
+
+
+def list_archive_images(zip_file: str) -> List[str]:
+    """
+    列出压缩包中可导入的图片条目，跳过目录、隐藏文件与过大的条目
+    """
+    with zipfile.ZipFile(zip_file) as zf:
+        names = []
+        for info in zf.infolist():
+            if info.is_dir() or info.file_size > IMPORT_MAX_ENTRY_SIZE:
+                continue
+            base = os.path.basename(info.filename)
+            if not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if os.path.splitext(base)[1].lower() in IMPORT_EXTENSIONS:
+                names.append(info.filename)
+        return names
+
+
+class ArchiveReader:
+    """
+    每个线程各自打开一份压缩包句柄，避免多线程读取时争用同一个文件指针
+    """
+
+    def __init__(self, zip_file: str):
+        self.zip_file = zip_file
+        self._local = threading.local()
+        self._opened: List[zipfile.ZipFile] = []
+        self._lock = threading.Lock()
+
+    def read(self, name: str) -> bytes:
+        zf = getattr(self._local, "zf", None)
+        if zf is None:
+            zf = zipfile.ZipFile(self.zip_file)
+            self._local.zf = zf
+            with self._lock:
+                self._opened.append(zf)
+        return zf.read(name)
+
+    def close(self):
+        with self._lock:
+            for zf in self._opened:
+                zf.close()
+            self._opened.clear()
+
+
+class PreparedImage:
+    """
+    已校验、压缩并计算好哈希的待导入图片
+    """
+
+    __slots__ = ("name", "data", "info", "digest", "phash")
+
+    def __init__(self, name: str, data: bytes, info: dict, digest: str, phash: Optional[int]):
+        self.name = name
+        self.data = data
+        self.info = info
+        self.digest = digest
+        self.phash = phash
+
+
+def _prepare(
+    reader: ArchiveReader,
+    name: str,
+    transform: Optional[Callable[[bytes], bytes]],
+    similar: bool,
+) -> Optional[PreparedImage]:
+    data = reader.read(name)
+    info = probe_image(data)
+    if info is None:
+        return None
+    if transform:
+        # 与单张存图一致：压缩失败时保留原图，而不是把条目计为无效
+        try:
+            data = transform(data)
+            info = probe_image(data) or info
+        except Exception as e:
+            logger.error(f"压缩图片失败【{name}】: {e}")
+    phash = None
+    if similar:
+        try:
+            phash = dhash(data)
+        except Exception:
+            phash = None
+    return PreparedImage(name, data, info, hash_bytes(data), phash)
+
+
+async def iter_archive_images(
+    zip_file: str,
+    names: List[str],
+    transform: Optional[Callable[[bytes], bytes]] = None,
+    similar: bool = False,
+) -> AsyncIterator[Tuple[str, Optional[PreparedImage]]]:
+    """
+    在线程池中逐个读取、校验、压缩压缩包条目，处理中的条目数不超过 IMPORT_WINDOW
+    Args:
+        zip_file: 压缩包路径
+        names: 要处理的条目名
+        transform: 图片变换(如压缩)，在工作线程中执行
+        similar: 是否计算感知哈希
+
+    Returns:
+        按完成顺序产出 (条目名, PreparedImage | None)，无法识别或读取失败的条目为 None
+    """
+    loop = asyncio.get_running_loop()
+    reader = ArchiveReader(zip_file)
+    pending = set()
+    remaining = iter(names)
+    try:
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="qgcj-import") as pool:
+
+            async def run(name: str) -> Tuple[str, Optional[PreparedImage]]:
+                try:
+                    return name, await loop.run_in_executor(pool, _prepare, reader, name, transform, similar)
+                except Exception:
+                    return name, None
+
+            def fill():
+                while len(pending) < IMPORT_WINDOW:
+                    name = next(remaining, None)
+                    if name is None:
+                        return
+                    pending.add(asyncio.ensure_future(run(name)))
+
+            fill()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    yield future.result()
+                fill()
+    finally:
+        for future in pending:
+            future.cancel()
+        reader.close()
@@ -0,0 +1,197 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+from astrbot import logger
+
+J = TypeVar("J")
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """
+    令牌桶限流：每秒补充 rate 个令牌，最多积累 burst 个
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        """
+        取一个令牌，没有令牌时返回 False
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class IngestQueue(Generic[J, T]):
+    """
+    有界的异步收集队列：消息处理器只负责入队，由工作协程下载处理，结果攒批后一次提交
+    队列已满或来源超出限流时直接丢弃，不阻塞消息处理
+    """
+
+    def __init__(
+        self,
+        process: Callable[[J], Awaitable[Optional[T]]],
+        commit: Callable[[List[T]], Awaitable[None]],
+        maxsize: int = 64,
+        workers: int = 2,
+        batch_size: int = 8,
+        batch_delay: float = 2.0,
+        rate: float = 0.5,
+        burst: int = 5,
+    ):
+        """
+        Args:
+            process: 处理单个任务，返回待提交的结果，返回 None 表示跳过
+            commit: 批量提交结果
+            maxsize: 队列长度上限
+            workers: 工作协程数
+            batch_size: 攒够多少个结果立即提交
+            batch_delay: 结果最多等待多久(秒)后提交
+            rate: 每个来源每秒允许入队的任务数
+            burst: 每个来源允许的突发任务数
+        """
+        self.process = process
+        self.commit = commit
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.rate = rate
+        self.burst = burst
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._buckets: Dict[str, TokenBucket] = {}
+        # 空闲到令牌已回满的桶与新建的桶等价，按此间隔清理，避免来源越积越多
+        self._bucket_idle = burst / rate if rate > 0 else float("inf")
+        self._next_prune = time.monotonic() + self._bucket_idle
+        self._batch: List[T] = []
+        self._tasks: List[asyncio.Task] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.dropped_full = 0
+        self.dropped_rate = 0
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.committed = 0
+
+    @property
+    def depth(self) -> int:
+        """
+        排队中的任务数
+        """
+        return self._queue.qsize()
+
+    def start(self):
+        """
+        启动工作协程
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def offer(self, source: str, job: J) -> bool:
+        """
+        尝试入队，不等待
+        Args:
+            source: 限流的来源(如群号)
+            job: 任务
+
+        Returns:
+            bool: 是否入队成功
+        """
+        self._prune_buckets()
+        bucket = self._buckets.get(source)
+        if bucket is None:
+            bucket = self._buckets[source] = TokenBucket(self.rate, self.burst)
+        if not bucket.take():
+            self.dropped_rate += 1
+            return False
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped_full += 1
+            return False
+        self.accepted += 1
+        self.start()
+        return True
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self._bucket_idle
+        idle = [source for source, bucket in self._buckets.items() if now - bucket.updated >= self._bucket_idle]
+        for source in idle:
+            del self._buckets[source]
+
+    async def close(self):
+        """
+        停止工作协程并提交已处理的结果，排队中未处理的任务被丢弃
+        """
+        for task in self._tasks:
+            task.cancel()
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                item = await self.process(job)
+                self.processed += 1
+                if item is None:
+                    self.skipped += 1
+                    continue
+                self._batch.append(item)
+                if len(self._batch) >= self.batch_size:
+                    await self._flush()
+                elif self._flush_task is None or self._flush_task.done():
+                    self._flush_task = asyncio.create_task(self._delayed_flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"收集任务处理失败: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.batch_delay)
+        await self._flush()
+
+    async def _flush(self):
+        items, self._batch = self._batch, []
+        if not items:
+            return
+        try:
+            await self.commit(items)
+            self.committed += len(items)
+        except Exception as e:
+            self.failed += len(items)
+            logger.error(f"批量提交收集结果失败: {e}")
+
+    def stats(self) -> dict:
+        """
+        队列统计
+        """
+        return {
+            "depth": self.depth,
+            "maxsize": self._queue.maxsize,
+            "accepted": self.accepted,
+            "dropped_full": self.dropped_full,
+            "dropped_rate": self.dropped_rate,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "committed": self.committed,
+        }
@@ -0,0 +1,66 @@
+from typing import Dict, Iterable, Set
+
+
+class KeywordIndex:
+    """
+    关键词倒排索引：关键词 -> 图库名集合，精准与模糊分开维护
+    """
+
+    def __init__(self):
+        self.exact: Dict[str, Set[str]] = {}
+        self.fuzzy: Dict[str, Set[str]] = {}
+        # 关键词集合的版本号，变更时递增，用于判断依赖索引的缓存是否需要重建
+        self.version = 0
+        self.fuzzy_version = 0
+
+    def add(self, keyword: str, gallery_name: str, is_fuzzy: bool = False):
+        """
+        登记关键词
+        """
+        index = self.fuzzy if is_fuzzy else self.exact
+        if keyword not in index:
+            index[keyword] = set()
+            self.version += 1
+            if is_fuzzy:
+                self.fuzzy_version += 1
+        index[keyword].add(gallery_name)
+
+    def remove(self, keyword: str, gallery_name: str, is_fuzzy: bool = False):
+        """
+        移除关键词，没有图库引用时删除该关键词
+        """
+        index = self.fuzzy if is_fuzzy else self.exact
+        names = index.get(keyword)
+        if names is None:
+            return
+        names.discard(gallery_name)
+        if not names:
+            del index[keyword]
+            self.version += 1
+            if is_fuzzy:
+                self.fuzzy_version += 1
+
+    def add_gallery(self, gallery_name: str, exact_keywords: Iterable[str], fuzzy_keywords: Iterable[str]):
+        """
+        登记图库的全部关键词
+        """
+        for keyword in exact_keywords:
+            self.add(keyword, gallery_name)
+        for keyword in fuzzy_keywords:
+            self.add(keyword, gallery_name, is_fuzzy=True)
+
+    def remove_gallery(self, gallery_name: str, exact_keywords: Iterable[str], fuzzy_keywords: Iterable[str]):
+        """
+        移除图库的全部关键词
+        """
+        for keyword in exact_keywords:
+            self.remove(keyword, gallery_name)
+        for keyword in fuzzy_keywords:
+            self.remove(keyword, gallery_name, is_fuzzy=True)
+
+    def lookup(self, keyword: str, is_fuzzy: bool = False) -> Set[str]:
+        """
+        查找包含该关键词的图库名
+        """
+        index = self.fuzzy if is_fuzzy else self.exact
+        return index.get(keyword, set())
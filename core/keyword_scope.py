@@ -0,0 +1,128 @@
+from typing import Dict, Iterable, List, Optional, Set
+from data.plugins.qgcj.core.keyword_index import KeywordIndex
+from data.plugins.qgcj.core.matcher import FuzzyMatcher, rank_hits
+
+# 未绑定群的图库登记在全局作用域，对所有消息生效
+GLOBAL_SCOPE = ""
+
+
+class KeywordScope:
+    """
+    一个作用域的关键词索引与模糊匹配自动机
+    """
+
+    def __init__(self):
+        self.index = KeywordIndex()
+        self.matcher = FuzzyMatcher(self.index)
+
+    def is_empty(self) -> bool:
+        return not self.index.exact and not self.index.fuzzy
+
+
+class ScopedKeywordIndex:
+    """
+    按群划分作用域的关键词索引
+    绑定了群的图库只登记在这些群的作用域中，群消息只与本群及全局作用域的关键词匹配；
+    all 汇总所有作用域的关键词，用于关键词列表与匹配前的预过滤
+    """
+
+    def __init__(self):
+        self.all = KeywordIndex()
+        self.scopes: Dict[str, KeywordScope] = {GLOBAL_SCOPE: KeywordScope()}
+        # 关键词与图库对应关系的版本号，任何登记或移除都会递增，用于使匹配结果缓存失效
+        self.version = 0
+
+    def touch(self):
+        """
+        标记关键词与图库的对应关系已变化
+        """
+        self.version += 1
+
+    @staticmethod
+    def _scope_ids(groups: Iterable[str]) -> List[str]:
+        return list(groups) or [GLOBAL_SCOPE]
+
+    def add(self, keyword: str, gallery_name: str, is_fuzzy: bool = False, groups: Iterable[str] = ()):
+        """
+        登记关键词到图库所属的作用域
+        """
+        self.touch()
+        self.all.add(keyword, gallery_name, is_fuzzy)
+        for scope_id in self._scope_ids(groups):
+            scope = self.scopes.get(scope_id)
+            if scope is None:
+                scope = self.scopes[scope_id] = KeywordScope()
+            scope.index.add(keyword, gallery_name, is_fuzzy)
+
+    def remove(self, keyword: str, gallery_name: str, is_fuzzy: bool = False, groups: Iterable[str] = ()):
+        """
+        从图库所属的作用域移除关键词，群作用域为空时一并删除
+        """
+        self.touch()
+        self.all.remove(keyword, gallery_name, is_fuzzy)
+        for scope_id in self._scope_ids(groups):
+            scope = self.scopes.get(scope_id)
+            if scope is None:
+                continue
+            scope.index.remove(keyword, gallery_name, is_fuzzy)
+            if scope_id != GLOBAL_SCOPE and scope.is_empty():
+                del self.scopes[scope_id]
+
+    def add_gallery(
+        self, gallery_name: str, exact_keywords: Iterable[str], fuzzy_keywords: Iterable[str], groups: Iterable[str] = ()
+    ):
+        """
+        登记图库的全部关键词
+        """
+        groups = list(groups)
+        for keyword in exact_keywords:
+            self.add(keyword, gallery_name, False, groups)
+        for keyword in fuzzy_keywords:
+            self.add(keyword, gallery_name, True, groups)
+
+    def remove_gallery(
+        self, gallery_name: str, exact_keywords: Iterable[str], fuzzy_keywords: Iterable[str], groups: Iterable[str] = ()
+    ):
+        """
+        移除图库的全部关键词
+        """
+        groups = list(groups)
+        for keyword in exact_keywords:
+            self.remove(keyword, gallery_name, False, groups)
+        for keyword in fuzzy_keywords:
+            self.remove(keyword, gallery_name, True, groups)
+
+    def scopes_for(self, group_id: Optional[str]) -> List[KeywordScope]:
+        """
+        消息可见的作用域：全局作用域，以及群消息所在群的作用域
+        """
+        scopes = [self.scopes[GLOBAL_SCOPE]]
+        if group_id and group_id in self.scopes:
+            scopes.append(self.scopes[group_id])
+        return scopes
+
+    def lookup(self, keyword: str, is_fuzzy: bool = False, group_id: Optional[str] = None) -> Set[str]:
+        """
+        查找该关键词在消息可见作用域中对应的图库名
+        """
+        names: Set[str] = set()
+        for scope in self.scopes_for(group_id):
+            names |= scope.index.lookup(keyword, is_fuzzy)
+        return names
+
+    def search(self, text: str, policy: str = "longest", group_id: Optional[str] = None) -> List[str]:
+        """
+        在消息可见的作用域中查找文本包含的模糊匹配词，并按策略排序
+        """
+        hits: Dict[str, int] = {}
+        for scope in self.scopes_for(group_id):
+            for keyword, start in scope.matcher.hits(text).items():
+                if keyword not in hits or start < hits[keyword]:
+                    hits[keyword] = start
+        return rank_hits(hits, policy)
+
+    def matchers_current(self, group_id: Optional[str] = None) -> bool:
+        """
+        消息可见作用域的自动机是否都已是最新，后台重建期间的匹配结果不应被缓存
+        """
+        return all(scope.matcher.is_current for scope in self.scopes_for(group_id))
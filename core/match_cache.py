@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional, Tuple
+
+MATCH_CACHE_SIZE = 2048
+
+
+class MatchCandidates(NamedTuple):
+    # 精准命中的图库名
+    exact: Tuple[str, ...]
+    # 按策略排序的 (模糊匹配词, 图库名)
+    fuzzy: Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+
+NO_CANDIDATES = MatchCandidates((), ())
+
+
+class MatchCache:
+    """
+    消息文本 -> 候选图库的 LRU 缓存
+    条目以关键词索引的版本号为标签，版本变化时整体失效
+    """
+
+    def __init__(self, max_entries: int = MATCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, MatchCandidates]" = OrderedDict()
+        self._version = -1
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: int) -> Optional[MatchCandidates]:
+        """
+        获取缓存的候选图库，版本号与缓存不一致时清空缓存
+        """
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+        candidates = self._entries.get(key)
+        if candidates is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return candidates
+
+    def put(self, key: Hashable, version: int, candidates: MatchCandidates):
+        """
+        记录候选图库，版本号已过期的结果不写入
+        """
+        if version != self._version:
+            return
+        self._entries[key] = candidates
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
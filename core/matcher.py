@@ -0,0 +1,136 @@
+import asyncio
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from astrbot import logger
+from data.plugins.qgcj.core.keyword_index import KeywordIndex
+
+# 模糊匹配词数量超过此值时，在后台线程中重建自动机，期间继续使用旧自动机
+BACKGROUND_REBUILD_THRESHOLD = 2000
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多模式匹配自动机，一次扫描找出文本中出现的所有关键词
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        for keyword in keywords:
+            if keyword:
+                self._insert(keyword)
+        self._build()
+
+    def _insert(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._out[state].append(keyword)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """
+        遍历文本中的所有命中
+        Returns:
+            (起始位置, 关键词)
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in out[state]:
+                yield end - len(keyword) + 1, keyword
+
+
+def rank_hits(hits: Dict[str, int], policy: str = "longest") -> List[str]:
+    """
+    按策略对命中的关键词排序
+    Args:
+        hits: 关键词 -> 首次出现的位置
+        policy: longest 最长匹配优先，first 最先出现优先
+    """
+    if policy == "first":
+        return sorted(hits, key=lambda k: (hits[k], -len(k)))
+    return sorted(hits, key=lambda k: (-len(k), hits[k]))
+
+
+class FuzzyMatcher:
+    """
+    基于关键词索引的模糊匹配器，关键词变更后自动重建自动机
+    """
+
+    def __init__(self, keyword_index: KeywordIndex):
+        self.keyword_index = keyword_index
+        self._automaton: Optional[AhoCorasick] = None
+        self._version = -1
+        self._pending: Optional[asyncio.Future] = None
+
+    @property
+    def is_current(self) -> bool:
+        """
+        当前自动机是否已包含最新的模糊匹配词(后台重建期间为 False)
+        """
+        return self._version == self.keyword_index.fuzzy_version
+
+    def hits(self, text: str) -> Dict[str, int]:
+        """
+        找出文本中出现的所有模糊匹配词
+        Returns:
+            关键词 -> 首次出现的位置
+        """
+        self._refresh()
+        if self._automaton is None:
+            return {}
+        hits: Dict[str, int] = {}
+        for start, keyword in self._automaton.iter_matches(text):
+            hits.setdefault(keyword, start)
+        return hits
+
+    def _refresh(self):
+        version = self.keyword_index.fuzzy_version
+        if version == self._version:
+            return
+        keywords = list(self.keyword_index.fuzzy)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or self._automaton is None or len(keywords) < BACKGROUND_REBUILD_THRESHOLD:
+            self._automaton = AhoCorasick(keywords)
+            self._version = version
+            return
+        if self._pending is None:
+            self._pending = loop.run_in_executor(None, AhoCorasick, keywords)
+            self._pending.add_done_callback(lambda future: self._install(future, version))
+
+    def _install(self, future: asyncio.Future, version: int):
+        self._pending = None
+        try:
+            automaton = future.result()
+        except Exception as e:
+            logger.error(f"重建模糊匹配自动机失败: {e}")
+            return
+        if version > self._version:
+            self._automaton = automaton
+            self._version = version
@@ -0,0 +1,31 @@
+from typing import Dict, Iterable, Optional
+from data.plugins.qgcj.core.matcher import AhoCorasick
+
+
+class SensitiveWordFilter:
+    """
+    敏感词过滤：所有敏感词编译为一个 Aho-Corasick 自动机，一次扫描完成检查
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = [word for word in dict.fromkeys(words) if word]
+        self._automaton = AhoCorasick(self.words) if self.words else None
+        # 用户 -> 累计命中次数
+        self.warnings: Dict[str, int] = {}
+
+    def find(self, text: str) -> Optional[str]:
+        """
+        返回文本中最先命中的敏感词，没有时返回 None
+        """
+        if self._automaton is None:
+            return None
+        for _, word in self._automaton.iter_matches(text):
+            return word
+        return None
+
+    def warn(self, user_id: str) -> int:
+        """
+        记录一次命中，返回该用户的累计命中次数
+        """
+        self.warnings[user_id] = self.warnings.get(user_id, 0) + 1
+        return self.warnings[user_id]
@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 from PIL import Image
 import re
+from data.plugins.qgcj.core.probe import probe_cache
 
 
 def get_image_info(path: str) -> dict:
@@ -17,6 +18,14 @@ def get_image_info(path: str) -> dict:
     if not path_obj.exists():
         return {"size": 0, "height": 0, "width": 0}
 
+    # 优先只读取文件头(带缓存)，无法识别的格式再交给 PIL
+    try:
+        info = probe_cache.get(str(path_obj))
+    except OSError:
+        info = None
+    if info:
+        return {"size": info["size"], "height": info["height"], "width": info["width"]}
+
     try:
         with Image.open(path_obj) as img:
             width, height = img.size
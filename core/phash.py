@@ -0,0 +1,97 @@
+from io import BytesIO
+from typing import List, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+DHASH_SIZE = 8
+
+
+def dhash(image_bytes: bytes, hash_size: int = DHASH_SIZE) -> int:
+    """
+    计算图片的差值感知哈希(dHash)
+    Args:
+        image_bytes: 图片字节流
+        hash_size: 哈希边长，结果为 hash_size * hash_size 位
+
+    Returns:
+        int: 感知哈希
+    """
+    with Image.open(BytesIO(image_bytes)) as img:
+        # JPEG 可直接以低分辨率解码，避免完整解码大图
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    计算两个哈希的汉明距离
+    """
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    以汉明距离为度量的 BK 树，用于近似图片的亚线性查找
+    """
+
+    def __init__(self):
+        # 节点结构: [哈希, 文件名集合, {距离: 子节点}]
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, item: str):
+        """
+        添加哈希
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = [value, {item}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {item}, {}]
+                return
+            node = child
+
+    def remove(self, value: int, item: str):
+        """
+        移除哈希，节点保留以维持树结构
+        """
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if item in node[1]:
+                    node[1].discard(item)
+                    self.size -= 1
+                return
+            node = node[2].get(distance)
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        查找汉明距离不超过 max_distance 的所有图片
+        """
+        result = []
+        if self.root is None:
+            return result
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                result.extend((distance, item) for item in node[1])
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in node[2].items() if low <= d <= high)
+        return sorted(result)
+
+    def __len__(self) -> int:
+        return self.size
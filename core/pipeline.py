@@ -0,0 +1,102 @@
+import time
+from functools import cached_property
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from astrbot import logger
+from astrbot.core.platform.message_components import Image
+
+
+class MessageContext:
+    """
+    一条消息在流水线各阶段间共享的解析结果，各字段在首次访问时解析一次
+    """
+
+    def __init__(self, event: Any):
+        self.event = event
+        self.stopped = False
+
+    @cached_property
+    def chain(self) -> list:
+        return self.event.get_messages()
+
+    @cached_property
+    def text(self) -> str:
+        return self.event.message_str.strip()
+
+    @cached_property
+    def images(self) -> List[Image]:
+        return [comp for comp in self.chain if isinstance(comp, Image)]
+
+    @cached_property
+    def group_id(self) -> Optional[str]:
+        return self.event.get_group_id() or None
+
+    @cached_property
+    def sender_id(self) -> str:
+        return self.event.get_sender_id()
+
+    @property
+    def single_image(self) -> Optional[Image]:
+        """
+        消息只包含一张图片时返回该图片
+        """
+        if len(self.chain) == 1 and self.images:
+            return self.images[0]
+        return None
+
+    def stop(self):
+        """
+        跳过后续阶段
+        """
+        self.stopped = True
+
+
+Stage = Callable[[MessageContext], Awaitable[Any]]
+
+
+class MessagePipeline:
+    """
+    按顺序执行的消息处理流水线
+    每个阶段返回要发送的结果(或 None)，调用 ctx.stop() 后后续阶段不再执行；
+    单个阶段出错只记录日志，不影响后续阶段
+    """
+
+    def __init__(self):
+        self._stages: List[Tuple[str, Stage]] = []
+        # 阶段名 -> [执行次数, 中止次数, 累计耗时(秒)]
+        self._stats: Dict[str, list] = {}
+
+    def add(self, name: str, stage: Stage):
+        """
+        在末尾追加一个阶段
+        """
+        self._stages.append((name, stage))
+        self._stats[name] = [0, 0, 0.0]
+
+    async def run(self, ctx: MessageContext) -> AsyncIterator[Any]:
+        """
+        依次执行各阶段，产出各阶段返回的结果
+        """
+        for name, stage in self._stages:
+            stats = self._stats[name]
+            stats[0] += 1
+            start = time.perf_counter()
+            try:
+                result = await stage(ctx)
+            except Exception as e:
+                logger.error(f"消息处理阶段【{name}】出错: {e}")
+                result = None
+            stats[2] += time.perf_counter() - start
+            if result is not None:
+                yield result
+            if ctx.stopped:
+                stats[1] += 1
+                break
+
+    def stats(self) -> List[dict]:
+        """
+        各阶段的执行统计
+        """
+        return [
+            {"stage": name, "runs": runs, "stops": stops, "avg_ms": elapsed / runs * 1000 if runs else 0.0}
+            for name, (runs, stops, elapsed) in self._stats.items()
+        ]
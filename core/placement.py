@@ -0,0 +1,113 @@
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from astrbot import logger
+
+PLACEMENT_POLICIES = ("first", "most_free", "weighted")
+
+
+def free_bytes(root: str) -> int:
+    """
+    获取目录所在磁盘的剩余空间，目录不可用时返回 0
+    """
+    try:
+        os.makedirs(root, exist_ok=True)
+        return shutil.disk_usage(root).free
+    except OSError as e:
+        logger.warning(f"获取目录【{root}】剩余空间失败: {e}")
+        return 0
+
+
+class GalleryPlacer:
+    """
+    在多个图库总目录之间选择新图库的存放位置
+    first: 总是第一个目录；most_free: 剩余空间最多的目录；
+    weighted: 按剩余空间加权的平滑轮询
+    剩余空间会按目录上正在进行的读写任务数折算，繁忙的目录优先级降低
+    """
+
+    def __init__(self, roots: List[str], policy: str = "most_free"):
+        self.roots = roots
+        self.policy = policy
+        self._busy: Dict[str, int] = {root: 0 for root in roots}
+        # 平滑加权轮询的当前权重
+        self._current: Dict[str, float] = {root: 0.0 for root in roots}
+
+    def choose(self, exclude: Optional[str] = None) -> str:
+        """
+        选择一个总目录
+        Args:
+            exclude: 不参与选择的目录(如图库当前所在的目录)
+        """
+        roots = [root for root in self.roots if root != exclude] or self.roots
+        if self.policy == "first" or len(roots) == 1:
+            return roots[0]
+        weights = {root: free_bytes(root) / (1 + self._busy.get(root, 0)) for root in roots}
+        if self.policy == "weighted":
+            total = sum(weights.values())
+            if total > 0:
+                for root in roots:
+                    self._current[root] = self._current.get(root, 0.0) + weights[root]
+                chosen = max(roots, key=lambda r: self._current[r])
+                self._current[chosen] -= total
+                return chosen
+        return max(roots, key=lambda r: weights[r])
+
+    def root_of(self, path: str) -> Optional[str]:
+        """
+        查找路径所在的总目录
+        """
+        for root in self.roots:
+            if os.path.abspath(path).startswith(os.path.join(os.path.abspath(root), "")):
+                return root
+        return None
+
+    @contextmanager
+    def busy(self, root: Optional[str]) -> Iterator[None]:
+        """
+        标记目录上有一个读写任务在进行
+        """
+        if root is None:
+            yield
+            return
+        self._busy[root] = self._busy.get(root, 0) + 1
+        try:
+            yield
+        finally:
+            self._busy[root] -= 1
+
+    def stats(self) -> List[dict]:
+        """
+        各总目录的剩余空间与繁忙程度
+        """
+        return [{"root": root, "free": free_bytes(root), "busy": self._busy.get(root, 0)} for root in self.roots]
+
+
+def _link_or_copy(src: str, dst: str):
+    # 同一文件系统上优先建立硬链接，避免复制数据
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def move_tree(src: str, dst: str) -> str:
+    """
+    移动目录：优先原子重命名；跨设备时逐个硬链接或复制后删除源目录
+    Returns:
+        str: 使用的方式 rename 或 copy
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.rename(src, dst)
+        return "rename"
+    except OSError as e:
+        logger.info(f"无法直接重命名【{src}】({e})，改为复制")
+    tmp_dst = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.moving")
+    if os.path.exists(tmp_dst):
+        shutil.rmtree(tmp_dst)
+    shutil.copytree(src, tmp_dst, copy_function=_link_or_copy)
+    os.rename(tmp_dst, dst)
+    shutil.rmtree(src)
+    return "copy"
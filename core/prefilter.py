@@ -0,0 +1,62 @@
+from typing import Dict, Set
+from data.plugins.qgcj.core.keyword_index import KeywordIndex
+
+
+class KeywordPrefilter:
+    """
+    匹配前的快速过滤：按精准匹配词本身与模糊匹配词的首字/首二元组，
+    先排除不可能命中任何关键词的消息，再交给完整的匹配流程
+    """
+
+    def __init__(self, keyword_index: KeywordIndex):
+        self.keyword_index = keyword_index
+        self.accepted = 0
+        self.rejected = 0
+        self._version = -1
+        self._exact_lengths: Set[int] = set()
+        self._fuzzy_chars: Set[str] = set()
+        self._fuzzy_bigrams: Set[str] = set()
+
+    def may_match(self, text: str) -> bool:
+        """
+        判断消息是否可能命中关键词，返回 False 时一定不会命中
+        """
+        self._refresh()
+        if self._check(text):
+            self.accepted += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def _check(self, text: str) -> bool:
+        # 长度只是廉价的预检，长度相同的消息仍需确认确实是某个精准匹配词
+        if len(text) in self._exact_lengths and text in self.keyword_index.exact:
+            return True
+        if self._fuzzy_chars and any(char in self._fuzzy_chars for char in text):
+            return True
+        bigrams = self._fuzzy_bigrams
+        if bigrams:
+            for i in range(len(text) - 1):
+                if text[i:i + 2] in bigrams:
+                    return True
+        return False
+
+    def _refresh(self):
+        if self._version == self.keyword_index.version:
+            return
+        self._exact_lengths = {len(keyword) for keyword in self.keyword_index.exact}
+        self._fuzzy_chars = {k for k in self.keyword_index.fuzzy if len(k) == 1}
+        self._fuzzy_bigrams = {k[:2] for k in self.keyword_index.fuzzy if len(k) >= 2}
+        self._version = self.keyword_index.version
+
+    def stats(self) -> Dict[str, float]:
+        """
+        获取过滤统计
+        """
+        total = self.accepted + self.rejected
+        return {
+            "total": total,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "reject_rate": self.rejected / total if total else 0.0,
+        }
@@ -0,0 +1,189 @@
+import os
+import struct
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# 读取文件头的字节数，足以覆盖绝大多数图片的尺寸信息与 EXIF 方向
+PROBE_HEAD_SIZE = 64 * 1024
+PROBE_CACHE_SIZE = 4096
+
+
+def probe_image(data: bytes, complete: bool = True) -> Optional[dict]:
+    """
+    只解析文件头获取图片信息，不解码像素
+    Args:
+        data: 图片字节流(或文件开头的一部分)
+        complete: data 是否为完整文件，不完整时无法统计 GIF 帧数
+
+    Returns:
+        dict | None: {"format", "width", "height", "frames", "orientation"}，
+        无法识别时返回 None；frames 未知时为 None
+    """
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            return _probe_png(data)
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return _probe_gif(data, complete)
+        if data.startswith(b"\xff\xd8"):
+            return _probe_jpeg(data)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _probe_webp(data)
+    except (struct.error, IndexError, ValueError):
+        return None
+    return None
+
+
+def _info(fmt: str, width: int, height: int, frames: Optional[int] = 1, orientation: int = 1) -> dict:
+    return {"format": fmt, "width": width, "height": height, "frames": frames, "orientation": orientation}
+
+
+def _probe_png(data: bytes) -> Optional[dict]:
+    width, height = struct.unpack(">II", data[16:24])
+    frames = 1
+    # APNG 的 acTL 块位于 IDAT 之前
+    pos = 8
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        if chunk_type == b"acTL":
+            frames = struct.unpack(">I", data[pos + 8:pos + 12])[0]
+            break
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        pos += length + 12
+    return _info("PNG", width, height, frames)
+
+
+def _skip_sub_blocks(data: bytes, pos: int) -> int:
+    while True:
+        size = data[pos]
+        pos += 1
+        if size == 0:
+            return pos
+        pos += size
+
+
+def _probe_gif(data: bytes, complete: bool) -> Optional[dict]:
+    width, height, flags = struct.unpack("<HHB", data[6:11])
+    pos = 13
+    if flags & 0x80:
+        pos += 3 * (2 << (flags & 0x07))
+    frames = 0
+    try:
+        while pos < len(data):
+            block = data[pos]
+            if block == 0x3B:  # trailer
+                break
+            if block == 0x21:  # extension
+                pos = _skip_sub_blocks(data, pos + 2)
+            elif block == 0x2C:  # image descriptor
+                frames += 1
+                local_flags = data[pos + 9]
+                pos += 10
+                if local_flags & 0x80:
+                    pos += 3 * (2 << (local_flags & 0x07))
+                pos = _skip_sub_blocks(data, pos + 1)
+            else:
+                break
+    except IndexError:
+        if not complete:
+            frames = None
+    return _info("GIF", width, height, frames or None)
+
+
+def _exif_orientation(exif: bytes) -> int:
+    if not exif.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = exif[6:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+    count = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for i in range(count):
+        entry = ifd_offset + 2 + i * 12
+        tag = struct.unpack(endian + "H", tiff[entry:entry + 2])[0]
+        if tag == 0x0112:
+            return struct.unpack(endian + "H", tiff[entry + 8:entry + 10])[0]
+    return 1
+
+
+def _probe_jpeg(data: bytes) -> Optional[dict]:
+    pos = 2
+    orientation = 1
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and orientation == 1:
+            orientation = _exif_orientation(data[pos + 4:pos + 2 + length])
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return _info("JPEG", width, height, 1, orientation)
+        pos += 2 + length
+    return None
+
+
+def _probe_webp(data: bytes) -> Optional[dict]:
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return _info("WEBP", width & 0x3FFF, height & 0x3FFF)
+    if chunk == b"VP8L":
+        b0, b1, b2, b3 = data[21:25]
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        return _info("WEBP", width, height)
+    if chunk == b"VP8X":
+        flags = data[20]
+        width = 1 + int.from_bytes(data[24:27], "little")
+        height = 1 + int.from_bytes(data[27:30], "little")
+        frames = 1
+        if flags & 0x02:
+            frames = data.count(b"ANMF") or None
+        return _info("WEBP", width, height, frames)
+    return None
+
+
+class ImageProbeCache:
+    """
+    按 路径 + 修改时间 + 大小 缓存的图片头信息
+    """
+
+    def __init__(self, max_entries: int = PROBE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Optional[dict]]]" = OrderedDict()
+
+    def get(self, path: str) -> Optional[dict]:
+        """
+        获取图片头信息，文件未变更时直接返回缓存
+        Returns:
+            dict | None: probe_image 的结果，另含 "size"(字节)；文件不存在时返回 None
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._entries.pop(path, None)
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry and entry[0] == key:
+            self._entries.move_to_end(path)
+            return entry[1]
+
+        with open(path, "rb") as f:
+            head = f.read(PROBE_HEAD_SIZE)
+        info = probe_image(head, complete=stat.st_size <= PROBE_HEAD_SIZE)
+        if info is not None:
+            info["size"] = stat.st_size
+        self._entries[path] = (key, info)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return info
+
+
+probe_cache = ImageProbeCache()
@@ -0,0 +1,112 @@
+import random
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# 每个图库最多保留的分群抽取袋数量，超过时淘汰最久未使用的群
+MAX_SCOPED_BAGS = 64
+
+
+class ShuffleBag:
+    """
+    不重复随机抽取：一轮内每张图片只抽中一次，抽完后整袋重新装满
+    抽取、增加与移除都通过与末尾元素交换完成，时间复杂度 O(1)
+    """
+
+    def __init__(self):
+        self._items: List[str] = []
+        self._pos: Dict[str, int] = {}
+        # 尚未装过袋时忽略增删，首次抽取时按完整图片列表装袋
+        self._filled = False
+
+    def draw(self, images: List[str]) -> str:
+        """
+        抽取一张本轮尚未抽到的图片
+        Args:
+            images: 图库当前的图片列表，仅在整袋重新装满时遍历
+
+        Raises:
+            IndexError: 图库为空
+        """
+        if not self._items:
+            for item in images:
+                self._add(item)
+            self._filled = True
+        if not self._items:
+            raise IndexError("gallery is empty")
+        index = random.randrange(len(self._items))
+        item = self._items[index]
+        self._remove_at(index)
+        return item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item: str):
+        """
+        新图片加入本轮尚未抽取的部分
+        """
+        if self._filled:
+            self._add(item)
+
+    def _add(self, item: str):
+        if item not in self._pos:
+            self._pos[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item: str):
+        """
+        从袋中移除图片
+        """
+        index = self._pos.get(item)
+        if index is not None:
+            self._remove_at(index)
+
+    def _remove_at(self, index: int):
+        item = self._items[index]
+        last = self._items.pop()
+        if index < len(self._items):
+            self._items[index] = last
+            self._pos[last] = index
+        del self._pos[item]
+
+
+class ShuffleBags:
+    """
+    一个图库的抽取袋集合：全局一个袋，按群分开时每群一个袋(LRU 淘汰)
+    """
+
+    def __init__(self, max_scoped: int = MAX_SCOPED_BAGS):
+        self.max_scoped = max_scoped
+        self._global = ShuffleBag()
+        self._scoped: "OrderedDict[str, ShuffleBag]" = OrderedDict()
+
+    def get(self, scope: Optional[str] = None) -> ShuffleBag:
+        """
+        获取作用域对应的抽取袋，scope 为空时返回全局袋
+        """
+        if not scope:
+            return self._global
+        bag = self._scoped.get(scope)
+        if bag is None:
+            bag = self._scoped[scope] = ShuffleBag()
+            if len(self._scoped) > self.max_scoped:
+                self._scoped.popitem(last=False)
+        else:
+            self._scoped.move_to_end(scope)
+        return bag
+
+    def add(self, item: str):
+        """
+        图库新增图片时同步到所有抽取袋
+        """
+        self._global.add(item)
+        for bag in self._scoped.values():
+            bag.add(item)
+
+    def discard(self, item: str):
+        """
+        图库移除图片时同步到所有抽取袋
+        """
+        self._global.discard(item)
+        for bag in self._scoped.values():
+            bag.discard(item)
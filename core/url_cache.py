@@ -0,0 +1,74 @@
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+URL_CACHE_SIZE = 4096
+# 图片链接通常带有时效签名，过期后不再信任缓存
+URL_CACHE_TTL = 3600
+
+
+class CachedSource(NamedTuple):
+    digest: str
+    path: str
+    size: int
+    expires: float
+
+
+class UrlHashCache:
+    """
+    图片链接 -> (内容哈希, 本地文件) 的 LRU 缓存，条目带有效期
+    """
+
+    def __init__(self, max_entries: int = URL_CACHE_SIZE, ttl: float = URL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedSource]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[CachedSource]:
+        """
+        获取仍有效、且本地文件大小未变的缓存条目
+        """
+        entry = self._entries.get(url)
+        if entry is not None:
+            try:
+                valid = entry.expires > time.monotonic() and os.path.getsize(entry.path) == entry.size
+            except OSError:
+                valid = False
+            if valid:
+                self._entries.move_to_end(url)
+                self.hits += 1
+                return entry
+            del self._entries[url]
+        self.misses += 1
+        return None
+
+    def put(self, url: str, digest: str, path: str):
+        """
+        记录链接对应的本地文件
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self._entries[url] = CachedSource(digest, path, size, time.monotonic() + self.ttl)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        缓存统计
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+url_cache = UrlHashCache()
@@ -1,45 +1,100 @@
 import asyncio
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from PIL import Image
 import httpx
 import random
 import re
-from typing import Dict, List, Optional, Union
+import tempfile
+from typing import Dict, List, NamedTuple, Optional, Union
+from urllib.parse import urlsplit
 from astrbot import logger
-from astrbot.core.platform.message_components import Image as AstrImage
+from astrbot.core.platform.message_components import File as AstrFile, Image as AstrImage
+from .core.url_cache import url_cache
 
 # 图像压缩
-async def compress_image(image_bytes: bytes, max_size: int = 512) -> bytes:
+# 压缩在独立线程池中进行(PIL 解码/编码时会释放 GIL)，不阻塞事件循环
+COMPRESS_WORKERS = min(4, os.cpu_count() or 1)
+# 排队中的压缩任务超过此数量时，可丢弃的任务(自动收集)直接放弃
+COMPRESS_QUEUE_SIZE = 8
+
+_compress_executor: Optional[ThreadPoolExecutor] = None
+_compress_pending = 0
+
+
+def _get_compress_executor() -> ThreadPoolExecutor:
+    global _compress_executor
+    if _compress_executor is None:
+        _compress_executor = ThreadPoolExecutor(max_workers=COMPRESS_WORKERS, thread_name_prefix="qgcj-compress")
+    return _compress_executor
+
+
+def shutdown_compress_executor():
+    """
+    关闭压缩线程池
+    """
+    global _compress_executor
+    if _compress_executor is not None:
+        _compress_executor.shutdown(wait=False)
+        _compress_executor = None
+
+
+def compress_image_sync(image_bytes: bytes, max_size: int = 512) -> bytes:
+    """
+    在当前线程中压缩图片，供已在工作线程中执行的批量任务使用
+    """
+    img = Image.open(BytesIO(image_bytes))
+    width, height = img.size
+
+    if max(width, height) > max_size:
+        if width > height:
+            new_width = max_size
+            new_height = max(1, int(height * (max_size / width)))
+        else:
+            new_height = max_size
+            new_width = max(1, int(width * (max_size / height)))
+        # JPEG 草稿模式：解码时直接按 1/2、1/4、1/8 缩小，大图只需解码少量像素
+        img.draft("RGB", (new_width, new_height))
+        # 其他格式先用整数倍快速缩小，最后再做一次高质量重采样
+        factor = min(img.width // new_width, img.height // new_height)
+        if factor >= 2:
+            img = img.reduce(factor)
+        img = img.resize((new_width, new_height), Image.LANCZOS)
+
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    output_buffer = BytesIO()
+    img.save(output_buffer, format="JPEG")
+    return output_buffer.getvalue()
+
+
+async def compress_image(image_bytes: bytes, max_size: int = 512, droppable: bool = False) -> bytes | None:
     """
     压缩图片到指定大小
     Args:
         image_bytes: 图片字节流
         max_size: 最大边长（像素）
+        droppable: 压缩队列已满时是否允许丢弃该任务(自动收集为 True，存图命令为 False)
 
     Returns:
-        压缩后的图片字节流
+        压缩后的图片字节流，任务被丢弃时返回 None
     """
+    global _compress_pending
+    if droppable and _compress_pending >= COMPRESS_QUEUE_SIZE:
+        logger.warning(f"压缩队列已满({_compress_pending})，丢弃自动收集的图片")
+        return None
+
+    _compress_pending += 1
     try:
-        from io import BytesIO
-
-        img = Image.open(BytesIO(image_bytes))
-        width, height = img.size
-
-        if max(width, height) > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            img = img.resize((new_width, new_height), Image.ANTIALIAS)
-
-        output_buffer = BytesIO()
-        img.save(output_buffer, format="JPEG")
-        return output_buffer.getvalue()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_compress_executor(), compress_image_sync, image_bytes, max_size)
     except Exception as e:
         logger.error(f"压缩图片失败: {e}")
         return image_bytes
+    finally:
+        _compress_pending -= 1
 
 
 # 获取消息内容
@@ -57,23 +112,169 @@ async def get_message_content(event, reply: bool = True) -> Dict[str, str]:
     return {"text": text.strip()}
 
 
+# HTTP 客户端
+# 插件内共用一个连接池，复用 TCP/TLS 连接，避免每张图片都重新握手
+HTTP_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=30.0)
+# 同一主机同时进行的下载数(httpx 只提供全局连接上限)
+HTTP_PER_HOST = 6
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 默认的单张图片大小上限
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+
+_http_client: Optional[httpx.AsyncClient] = None
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+# 正在下载的链接 -> 下载任务，同一链接的并发请求共享一次下载
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    获取插件共用的 HTTP 客户端
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, follow_redirects=True)
+    return _http_client
+
+
+async def close_http_client():
+    """
+    关闭共用的 HTTP 客户端
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    _host_slots.clear()
+
+
+def _host_slot(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    slot = _host_slots.get(host)
+    if slot is None:
+        slot = _host_slots[host] = asyncio.Semaphore(HTTP_PER_HOST)
+    return slot
+
+
+class FetchedImage(NamedTuple):
+    """
+    下载得到的图片及其内容哈希
+    """
+    data: bytes
+    digest: str
+    # 图片链接，本地文件为 None
+    source: Optional[str] = None
+    # 是否读取自已入库的图片文件
+    stored: bool = False
+
+
+async def _stream(url: str, max_size: Optional[int], sink) -> Optional[str]:
+    """
+    分块下载，超过 max_size 时中止
+    Args:
+        sink: 接收每个数据块的函数
+
+    Returns:
+        str | None: 内容哈希(sha256)，失败或超限时返回 None
+    """
+    hasher = hashlib.sha256()
+    received = 0
+    async with _host_slot(url):
+        async with get_http_client().stream("GET", url) as response:
+            response.raise_for_status()
+            length = response.headers.get("content-length")
+            if max_size and length and length.isdigit() and int(length) > max_size:
+                logger.warning(f"文件过大({int(length)} 字节)，已放弃下载: {url}")
+                return None
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if max_size and received > max_size:
+                    logger.warning(f"文件超过 {max_size} 字节，已中止下载: {url}")
+                    return None
+                hasher.update(chunk)
+                sink(chunk)
+    return hasher.hexdigest()
+
+
+async def fetch_bytes(url: str, max_size: Optional[int] = MAX_IMAGE_SIZE) -> FetchedImage | None:
+    """
+    流式下载到内存，边下载边计算内容哈希；同一链接的并发请求只下载一次
+    """
+    future = _inflight.get(url)
+    if future is None:
+        future = asyncio.ensure_future(_fetch_bytes(url, max_size))
+        _inflight[url] = future
+        future.add_done_callback(lambda _: _inflight.pop(url, None))
+    # 单个请求被取消时不影响其他等待同一下载的请求
+    return await asyncio.shield(future)
+
+
+async def _fetch_bytes(url: str, max_size: Optional[int]) -> FetchedImage | None:
+    buffer = bytearray()
+    try:
+        digest = await _stream(url, max_size, buffer.extend)
+    except Exception as e:
+        logger.error(f"下载图片失败: {e}")
+        return None
+    if digest is None:
+        return None
+    return FetchedImage(bytes(buffer), digest, url)
+
+
 # 下载文件
-async def download_file(url: str, save_path: str) -> bool:
+async def download_file(url: str, save_path: str, max_size: Optional[int] = None) -> bool:
     """
-    下载文件
+    流式下载文件，写入临时文件后重命名
     """
+    tmp_path = f"{save_path}.part"
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            with open(save_path, "wb") as f:
-                f.write(response.content)
-            return True
+        with open(tmp_path, "wb") as f:
+            digest = await _stream(url, max_size, f.write)
+        if digest is None:
+            os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, save_path)
+        return True
     except Exception as e:
         logger.error(f"下载文件失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return False
 
 
+# 获取文件
+async def get_file(event, save_dir: str, reply: bool = True, max_size: Optional[int] = None) -> str | None:
+    """
+    获取消息(或回复的消息)中的文件，返回本地路径；远程文件以唯一的临时文件名下载到 save_dir，
+    不使用消息中的文件名，避免覆盖目录中的其他文件
+    """
+    messages = list(event.get_messages())
+    if reply and event.message_obj.reply:
+        reply_id = event.message_obj.reply.message_id
+        if reply_id:
+            reply_event = await event.get_event_by_msg_id(reply_id)
+            messages.extend(reply_event.get_messages())
+    for comp in messages:
+        if not isinstance(comp, AstrFile):
+            continue
+        url = getattr(comp, "url", None)
+        if url:
+            os.makedirs(save_dir, exist_ok=True)
+            suffix = os.path.splitext(os.path.basename(comp.name or ""))[1] or ".zip"
+            fd, save_path = tempfile.mkstemp(suffix=suffix, dir=save_dir)
+            os.close(fd)
+            if await download_file(url, save_path, max_size):
+                return save_path
+            if os.path.exists(save_path):
+                os.remove(save_path)
+            continue
+        path = await comp.get_file() if hasattr(comp, "get_file") else getattr(comp, "file", None)
+        if path and os.path.exists(path):
+            return path
+    return None
+
+
 # 获取昵称
 def get_nickname(event) -> str:
     """
@@ -83,40 +284,53 @@ def get_nickname(event) -> str:
 
 
 # 获取图片
-async def get_image(event, reply: bool = True) -> bytes | None:
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def fetch_image_component(comp, max_size: Optional[int] = MAX_IMAGE_SIZE) -> FetchedImage | None:
     """
-    获取图片
+    获取单个图片消息段的图片及其内容哈希
+    """
+    if comp.url:
+        # 已入库过的链接直接读取本地文件，无需再次下载
+        cached = url_cache.get(comp.url)
+        if cached:
+            try:
+                data = await asyncio.to_thread(_read_file, cached.path)
+                return FetchedImage(data, cached.digest, comp.url, stored=True)
+            except OSError:
+                pass
+        return await fetch_bytes(comp.url, max_size)
+    with open(comp.path, "rb") as f:
+        data = f.read()
+    return FetchedImage(data, hashlib.sha256(data).hexdigest())
+
+
+async def fetch_image(event, reply: bool = True, max_size: Optional[int] = MAX_IMAGE_SIZE) -> FetchedImage | None:
+    """
+    获取消息(或回复的消息)中的第一张图片及其内容哈希
     """
-    image_bytes = None
     # 优先从当前消息中获取图片
     for comp in event.get_messages():
-        if isinstance(comp, AstrImage):
-            if comp.url:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(comp.url)
-                    response.raise_for_status()
-                    image_bytes = response.content
-                    break
-            elif comp.path:
-                with open(comp.path, "rb") as f:
-                    image_bytes = f.read()
-                    break
-    
+        if isinstance(comp, AstrImage) and (comp.url or comp.path):
+            return await fetch_image_component(comp, max_size)
+
     # 如果当前消息没有图片，且是回复消息，尝试从回复消息中获取
-    if image_bytes is None and reply and event.message_obj.reply:
+    if reply and event.message_obj.reply:
         reply_id = event.message_obj.reply.message_id
         if reply_id:
             reply_event = await event.get_event_by_msg_id(reply_id)
             for comp in reply_event.get_messages():
-                if isinstance(comp, AstrImage):
-                    if comp.url:
-                        async with httpx.AsyncClient() as client:
-                            response = await client.get(comp.url)
-                            response.raise_for_status()
-                            image_bytes = response.content
-                            break
-                    elif comp.path:
-                        with open(comp.path, "rb") as f:
-                            image_bytes = f.read()
-                            break
-    return image_bytes 
\ No newline at end of file
+                if isinstance(comp, AstrImage) and (comp.url or comp.path):
+                    return await fetch_image_component(comp, max_size)
+    return None
+
+
+async def get_image(event, reply: bool = True, max_size: Optional[int] = MAX_IMAGE_SIZE) -> bytes | None:
+    """
+    获取图片
+    """
+    fetched = await fetch_image(event, reply, max_size)
+    return fetched.data if fetched else None